@@ -0,0 +1,18 @@
+# gunicorn.conf.py - Render 啟動設定（在專案目錄執行 `gunicorn main:app` 會自動讀取）
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+
+# master 先載入 main：編譯好的 regex、提示字串與 SDK 物件在 fork 後以 copy-on-write 共用。
+# 持有資料庫連線的子代理人與 CodeAgent 都是第一次使用時才在各 worker 內建立，不會跨 fork 共用。
+preload_app = True
+
+
+def post_worker_init(worker):
+    # 每個 worker 啟動後都嘗試開啟價格追蹤背景任務，main 內的檔案鎖保證只有一個 worker 會成功
+    from main import start_background_tasks
+    start_background_tasks()
@@ -3,16 +3,27 @@ import os
 import json
 import logging
 import re
-from typing import Dict
+import fcntl
+import functools
+import threading
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+import requests
 from flask import Flask, request, abort
+from cachetools import TTLCache
 
 # LINE Bot SDK
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
+from linebot.http_client import HttpClient, RequestsHttpClient, RequestsHttpResponse
 from linebot.models import MessageEvent, TextMessage, TextSendMessage
 
-# smolagents
+# smolagents / OpenAI
+import httpx
+import litellm
 from smolagents import CodeAgent, LiteLLMModel, tool
+from openai import OpenAI
 
 # ===== 日誌 =====
 logging.basicConfig(
@@ -32,59 +43,178 @@ if not OPENAI_API_KEY:
     logger.warning("⚠️ OPENAI_API_KEY 尚未設定")
 
 # ===== 初始化 SDK =====
-line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN) if CHANNEL_ACCESS_TOKEN else None
+class SessionHttpClient(RequestsHttpClient):
+    """LINE SDK 預設每次呼叫都用 requests.post 重新連線；改用同一個 Session 保持 keep-alive"""
+
+    def __init__(self, timeout=HttpClient.DEFAULT_TIMEOUT):
+        super().__init__(timeout)
+        self.session = requests.Session()
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        response = self.session.get(url, headers=headers, params=params, stream=stream,
+                                    timeout=self.timeout if timeout is None else timeout)
+        return RequestsHttpResponse(response)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        response = self.session.post(url, headers=headers, data=data,
+                                     timeout=self.timeout if timeout is None else timeout)
+        return RequestsHttpResponse(response)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        response = self.session.put(url, headers=headers, data=data,
+                                    timeout=self.timeout if timeout is None else timeout)
+        return RequestsHttpResponse(response)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        response = self.session.delete(url, headers=headers, data=data,
+                                       timeout=self.timeout if timeout is None else timeout)
+        return RequestsHttpResponse(response)
+
+line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN, http_client=SessionHttpClient) if CHANNEL_ACCESS_TOKEN else None
 handler = WebhookHandler(CHANNEL_SECRET) if CHANNEL_SECRET else None
+# OpenAI 分類器與 LiteLLM（CodeAgent 的模型呼叫）共用同一個 keep-alive 連線池，省下每次呼叫的 TLS 交握
+llm_http_client = httpx.Client(timeout=30, limits=httpx.Limits(max_keepalive_connections=20, max_connections=100))
+litellm.client_session = llm_http_client
+openai_client = OpenAI(api_key=OPENAI_API_KEY, http_client=llm_http_client) if OPENAI_API_KEY else None
+
+# ===== 子代理人 =====
+# 模組在啟動時匯入一次；實例需要 API 金鑰與資料庫連線，於第一次使用時建立並在程序內共用
+try:
+    from agents.product_review_agent import create_product_review_agent
+except ImportError as e:
+    create_product_review_agent = None
+    logger.warning("⚠️ 商品評論代理人模組無法載入: %s", e)
+try:
+    from agents.price_tracker_agent import PriceTrackerAgent
+except ImportError as e:
+    PriceTrackerAgent = None
+    logger.warning("⚠️ 價格追蹤代理人模組無法載入: %s", e)
+
+# 子代理人名稱 -> 建立實例的函數；商品評論代理人由模組的工廠函數提供程序內共用的實例
+_SUB_AGENT_FACTORIES = {
+    'ProductReviewAgent': create_product_review_agent,
+    'PriceTrackerAgent': (lambda: PriceTrackerAgent(line_bot_api)) if PriceTrackerAgent else None,
+}
+# 子代理人實例跨 _EXECUTOR 的執行緒共用，必須可同時被多個執行緒呼叫：
+# ProductReviewAgent 的 CodeAgent 依執行緒各自建立（與 get_main_agent 相同的做法）
+_sub_agents = {}
+_sub_agents_lock = threading.Lock()
+
+def get_sub_agent(name: str):
+    agent = _sub_agents.get(name)
+    if agent is None:
+        with _sub_agents_lock:
+            agent = _sub_agents.get(name)
+            if agent is None:
+                factory = _SUB_AGENT_FACTORIES[name]
+                if factory is None:
+                    raise RuntimeError(f"{name} 模組未載入")
+                agent = factory()
+                _sub_agents[name] = agent
+    return agent
 
 # ===== Flask App =====
 app = Flask(__name__)
 
+# webhook 收到訊息後交給背景執行緒處理並立即回 200，避免 LINE 逾時重送；
+# reply token 約 30 秒內有效，延後回覆沒有問題
+_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("S2S_WORKERS", "8")), thread_name_prefix="s2s-worker")
+
 # ===== 系統提示 =====
 MAIN_AGENT_SYSTEM_PROMPT = """
 你是SmartShopSaver主控制代理人，負責理解用戶需求並分派任務給適當的子代理人。
 （以下略，保留你的原文規則與回應原則）
 """
 
-# ===== 工具 =====
-@tool
-def analyze_user_intent(message: str) -> Dict:
-    message_lower = message.lower()
-    non_shopping_indicators = [
-        "天氣","新聞","股票","股市","政治","選舉","運動","比賽",
-        "遊戲攻略","遊戲","電玩","料理","食譜","做菜","烹飪",
-        "健康","醫療","看病","醫生","藥","症狀","疾病",
-        "教育","學習","考試","作業","功課","學校",
-        "程式","編程","代碼","coding","python","java",
-        "數學","物理","化學","生物","科學","歷史","地理",
-        "音樂","歌曲","歌詞","電影","影片","電視","追劇",
-        "書籍","小說","詩詞","文學","作文","寫作",
-        "笑話","故事","聊天","閒聊","你是誰","你好嗎","早安","晚安","謝謝","再見","拜拜"
-    ]
-    for indicator in non_shopping_indicators:
-        if indicator in message_lower:
-            return {'message': message, 'intents': [], 'primary_intent': None, 'is_shopping_related': False}
-
-    review_keywords = ['評價','評論','好不好','好用','推薦','建議','分析','優點','缺點','心得','開箱','值得買','品質','耐用','商品資訊','產品介紹','規格','特色','功能','如何','怎麼樣','怎樣','好嗎','評測','測評','使用心得','用戶評價','買家評價','真實評價','網友評價','值不值得','適合','好壞','優劣','比較','差異','選擇']
-    price_keywords  = ['價格','多少錢','比價','追蹤','監控','通知','降價','便宜','特價','折扣','優惠','目標價','低於','售價','報價','賣多少','現在什麼價','幾元','幾塊','nt$','成本','定價','市價','行情','價位','預算','貴不貴','划算','cp值','性價比']
-
-    import re as _re
-    review_patterns = [r'(.+)(?:的)?評[價論](?:如何|怎[麼樣])?', r'(.+)好不好[用買]?', r'(.+)值[不得]?[得的]買[嗎?]?', r'(.+)推薦[嗎]?', r'(.+)怎麼樣', r'想?[買購](.+)', r'(.+)(?:跟|和|與)(.+)(?:哪個|那個)好', r'請?(?:分析|介紹|說明)(?:一下)?(.+)', r'(.+)(?:有什麼|有哪些)(?:優點|缺點)', r'(.+)適合(?:我|什麼人)?[嗎?]?']
-    price_patterns  = [r'(.+)(?:的)?價[格錢](?:是)?(?:多少|幾元)?', r'(.+)(?:要)?多少錢', r'(.+)賣(?:多少|幾元)', r'查(?:詢)?(.+)(?:的)?價[格錢]', r'比價(.+)', r'(.+)現在(?:什麼)?價[格位]', r'追蹤(.+)(?:的)?(?:價格|降價)', r'(.+)(?:降價|特價|優惠)(?:了[嗎?]|通知)', r'(.+)(?:在)?哪[裡裏](?:買)?(?:比較)?便宜', r'(.+)(?:貴不貴|划算[嗎?])']
-
-    review_score = 10 if any(_re.search(p, message, _re.IGNORECASE) for p in review_patterns) else sum(2 for k in review_keywords if k in message_lower)
-    price_score  = 10 if any(_re.search(p, message, _re.IGNORECASE) for p in price_patterns) else sum(2 for k in price_keywords  if k in message_lower)
+# 固定不變的指示放在前面、每則訊息不同的欄位放在最後，讓整段前綴可命中模型端的 prompt cache
+MAIN_AGENT_TASK_PROMPT = MAIN_AGENT_SYSTEM_PROMPT + """
+執行步驟：
+1. 使用 analyze_user_intent 分析用戶意圖
+2. 若 is_shopping_related 為 False，使用 send_line_reply 回覆拒答文案
+3. 否則依 primary_intent.agent 呼叫對應工具
+4. 用 send_line_reply 回覆用戶
+
+現在需要處理以下用戶訊息：
+"""
+
+ROUTER_SYSTEM_PROMPT = """
+你是SmartShopSaver的意圖分類器，判斷購物相關訊息該交給哪個子代理人：
+- 商品評價、推薦、優缺點、比較 → ProductReviewAgent
+- 價格查詢、比價、降價追蹤、通知 → PriceTrackerAgent
+只輸出 JSON：{"agent": "ProductReviewAgent"} 或 {"agent": "PriceTrackerAgent"}
+"""
+
+NON_SHOPPING_REPLY = "❌ 此問題與SmartShopSaver功能無關，無法回答。SmartShopSaver專注於協助您解決購物相關問題。"
+
+# ===== 意圖判斷規則（模組載入時預先編譯，一律比對小寫訊息）=====
+# LINE 單則文字上限 5000 字，實際購物問題多在 200 字內；先截斷再做任何 regex 掃描
+MAX_MESSAGE_CHARS = 512
+# 只用來判斷是否命中，不取群組；「A跟B哪個好」改寫成單一 .+? 以免兩個 (.+) 在不匹配時回溯到 O(n³)
+_REVIEW_PATTERNS = tuple(re.compile(p) for p in [
+    r'(.+)(?:的)?評[價論](?:如何|怎[麼樣])?', r'(.+)好不好[用買]?', r'(.+)值[不得]?[得的]買[嗎?]?', r'(.+)推薦[嗎]?', r'(.+)怎麼樣',
+    r'想?[買購](.+)', r'.(?:跟|和|與).+?(?:哪個|那個)好', r'請?(?:分析|介紹|說明)(?:一下)?(.+)', r'(.+)(?:有什麼|有哪些)(?:優點|缺點)', r'(.+)適合(?:我|什麼人)?[嗎?]?',
+])
+_PRICE_PATTERNS = tuple(re.compile(p) for p in [
+    r'(.+)(?:的)?價[格錢](?:是)?(?:多少|幾元)?', r'(.+)(?:要)?多少錢', r'(.+)賣(?:多少|幾元)', r'查(?:詢)?(.+)(?:的)?價[格錢]', r'比價(.+)',
+    r'(.+)現在(?:什麼)?價[格位]', r'追蹤(.+)(?:的)?(?:價格|降價)', r'(.+)(?:降價|特價|優惠)(?:了[嗎?]|通知)', r'(.+)(?:在)?哪[裡裏](?:買)?(?:比較)?便宜', r'(.+)(?:貴不貴|划算[嗎?])',
+])
+
+_NON_SHOPPING_INDICATORS = (
+    "天氣","新聞","股票","股市","政治","選舉","運動","比賽",
+    "遊戲攻略","遊戲","電玩","料理","食譜","做菜","烹飪",
+    "健康","醫療","看病","醫生","藥","症狀","疾病",
+    "教育","學習","考試","作業","功課","學校",
+    "程式","編程","代碼","coding","python","java",
+    "數學","物理","化學","生物","科學","歷史","地理",
+    "音樂","歌曲","歌詞","電影","影片","電視","追劇",
+    "書籍","小說","詩詞","文學","作文","寫作",
+    "笑話","故事","聊天","閒聊","你是誰","你好嗎","早安","晚安","謝謝","再見","拜拜",
+)
+_REVIEW_KEYWORDS = ('評價','評論','好不好','好用','推薦','建議','分析','優點','缺點','心得','開箱','值得買','品質','耐用','商品資訊','產品介紹','規格','特色','功能','如何','怎麼樣','怎樣','好嗎','評測','測評','使用心得','用戶評價','買家評價','真實評價','網友評價','值不值得','適合','好壞','優劣','比較','差異','選擇')
+_PRICE_KEYWORDS  = ('價格','多少錢','比價','追蹤','監控','通知','降價','便宜','特價','折扣','優惠','目標價','低於','售價','報價','賣多少','現在什麼價','幾元','幾塊','nt$','成本','定價','市價','行情','價位','預算','貴不貴','划算','cp值','性價比')
+_PRODUCT_INDICATORS = ('iphone','samsung','sony','apple','nike','adidas','asus','msi','acer','lenovo','hp','dell','lg','xiaomi','小米','oppo','vivo','huawei','華為','ps5','ps4','xbox','switch','nintendo','macbook','ipad','airpods','apple watch','手機','電腦','筆電','平板','耳機','滑鼠','鍵盤','螢幕','顯卡','主機','相機','手錶','電視','razer','雷蛇','viper','logitech','羅技','steelseries')
+
+def _keyword_alternation(keywords, overlapping: bool = False) -> "re.Pattern":
+    """把關鍵字清單編譯成單一 alternation；overlapping=True 時以 lookahead 找出所有起點的關鍵字（供計分）"""
+    body = '|'.join(map(re.escape, sorted(keywords, key=len, reverse=True)))
+    return re.compile(f'(?=({body}))' if overlapping else body)
+
+_NON_SHOP_RE = _keyword_alternation(_NON_SHOPPING_INDICATORS)
+_REVIEW_KW_RE = _keyword_alternation(_REVIEW_KEYWORDS, overlapping=True)
+_PRICE_KW_RE = _keyword_alternation(_PRICE_KEYWORDS, overlapping=True)
+_PRODUCT_KW_RE = _keyword_alternation(_PRODUCT_INDICATORS)
+
+@functools.lru_cache(maxsize=4096)
+def _score_intents(normalized: str) -> Tuple[Tuple[str, int, str, bool], ...]:
+    """意圖計分核心：輸入為正規化後的訊息，回傳不可變的 (type, score, agent, inferred) 以便快取"""
+    if _NON_SHOP_RE.search(normalized):
+        return ()
+
+    review_score = 10 if any(p.search(normalized) for p in _REVIEW_PATTERNS) else 2 * len(set(_REVIEW_KW_RE.findall(normalized)))
+    price_score  = 10 if any(p.search(normalized) for p in _PRICE_PATTERNS) else 2 * len(set(_PRICE_KW_RE.findall(normalized)))
 
     intents = []
     if review_score > 0:
-        intents.append({'type': 'review', 'score': review_score, 'agent': 'ProductReviewAgent'})
+        intents.append(('review', review_score, 'ProductReviewAgent', False))
     if price_score > 0:
-        intents.append({'type': 'price', 'score': price_score, 'agent': 'PriceTrackerAgent'})
+        intents.append(('price', price_score, 'PriceTrackerAgent', False))
+
+    if not intents and _PRODUCT_KW_RE.search(normalized):
+        intents.append(('review', 5, 'ProductReviewAgent', True))
+    return tuple(intents)
 
-    if not intents:
-        for indicator in ['iphone','samsung','sony','apple','nike','adidas','asus','msi','acer','lenovo','hp','dell','lg','xiaomi','小米','oppo','vivo','huawei','華為','ps5','ps4','xbox','switch','nintendo','macbook','ipad','airpods','apple watch','手機','電腦','筆電','平板','耳機','滑鼠','鍵盤','螢幕','顯卡','主機','相機','手錶','電視','razer','雷蛇','viper','logitech','羅技','steelseries']:
-            if indicator in message_lower:
-                intents.append({'type': 'review', 'score': 5, 'agent': 'ProductReviewAgent', 'inferred': True})
-                break
+def _intent_dict(intent_type: str, score: int, agent: str, inferred: bool) -> Dict:
+    intent = {'type': intent_type, 'score': score, 'agent': agent}
+    if inferred:
+        intent['inferred'] = True
+    return intent
 
+# ===== 工具 =====
+@tool
+def analyze_user_intent(message: str) -> Dict:
+    message = message[:MAX_MESSAGE_CHARS]
+    normalized = unicodedata.normalize('NFKC', message).strip().lower()
+    intents = [_intent_dict(*intent) for intent in _score_intents(normalized)]
     return {
         'message': message,
         'intents': intents,
@@ -92,38 +222,43 @@ def analyze_user_intent(message: str) -> Dict:
         'is_shopping_related': len(intents) > 0
     }
 
-@tool
-def invoke_product_review_agent(user_id: str, message: str) -> str:
+def review_with_status(user_id: str, message: str) -> Tuple[str, bool]:
+    """商品評論回覆與是否成功；只有成功的回覆才會被 dispatch_to_sub_agent 快取"""
     try:
-        from agents.product_review_agent import ProductReviewAgent
-        agent = ProductReviewAgent()
-        return agent.process_message(user_id, message)
+        return get_sub_agent('ProductReviewAgent').review(user_id, message)
     except Exception as e:
-        logger.error(f"商品評論代理人失敗: {e}", exc_info=True)
-        return "❌ 商品評論分析暫時無法使用，請稍後再試"
+        logger.error("商品評論代理人失敗: %s", e, exc_info=True)
+        return "❌ 商品評論分析暫時無法使用，請稍後再試", False
+
+@tool
+def invoke_product_review_agent(user_id: str, message: str) -> str:
+    return review_with_status(user_id, message)[0]
 
 @tool
 def invoke_price_tracker_agent(user_id: str, message: str) -> str:
     try:
-        from agents.price_tracker_agent import PriceTrackerAgent
-        agent = PriceTrackerAgent()
-        return agent.process_message(user_id, message)
+        return get_sub_agent('PriceTrackerAgent').process_message(user_id, message)
     except Exception as e:
-        logger.error(f"價格追蹤代理人失敗: {e}", exc_info=True)
+        logger.error("價格追蹤代理人失敗: %s", e, exc_info=True)
         return "❌ 價格查詢功能暫時無法使用，請稍後再試"
 
+# LINE 文字訊息上限 5000 字；超過時保留前 4900 字並加註截斷
+_LINE_TEXT_LIMIT = 5000
+_TRUNCATE_AT = 4900
+_TRUNCATE_SUFFIX = "\n\n⚠️ 內容過長已截斷"
+
 @tool
 def send_line_reply(reply_token: str, message: str) -> bool:
     if not line_bot_api:
         logger.error("LINE Bot API 未初始化（缺少金鑰）")
         return False
     try:
-        if len(message) > 5000:
-            message = message[:4900] + "\n\n⚠️ 內容過長已截斷"
+        if len(message) > _LINE_TEXT_LIMIT:
+            message = message[:_TRUNCATE_AT] + _TRUNCATE_SUFFIX
         line_bot_api.reply_message(reply_token, TextSendMessage(text=message))
         return True
     except Exception as e:
-        logger.error(f"發送LINE訊息失敗: {e}", exc_info=True)
+        logger.error("發送LINE訊息失敗: %s", e, exc_info=True)
         return False
 
 @tool
@@ -137,26 +272,112 @@ def create_main_agent() -> CodeAgent:
     tools = [analyze_user_intent, invoke_product_review_agent, invoke_price_tracker_agent, send_line_reply, generate_help_message]
     return CodeAgent(tools=tools, model=model, additional_authorized_imports=["re", "json"])
 
+# CodeAgent 在 run() 期間會寫入自己的 memory，不能跨執行緒同時使用；
+# 因此每個執行緒建立一次後重複使用（run() 預設 reset=True，會清掉上一輪的記憶）
+_agent_local = threading.local()
+
+def get_main_agent() -> CodeAgent:
+    agent = getattr(_agent_local, "agent", None)
+    if agent is None:
+        agent = _agent_local.agent = create_main_agent()
+    return agent
+
+# 規則式分類已命中句型（score >= 10）時直接派送給子代理人，不再經過 LLM 判斷
+_DIRECT_DISPATCH_MIN_SCORE = 10
+_SUB_AGENT_TOOLS = {
+    'ProductReviewAgent': invoke_product_review_agent,
+    'PriceTrackerAgent': invoke_price_tracker_agent,
+}
+
+# 商品評價回覆只取決於訊息內容，可跨用戶共用；價格追蹤會讀寫用戶的追蹤清單，不放進快取。
+# 可快取的子代理人對應到回傳 (回覆, 是否成功) 的函數，降級或錯誤回覆不寫入快取
+_CACHEABLE_AGENTS = {'ProductReviewAgent': review_with_status}
+_RESPONSE_CACHE = TTLCache(maxsize=2048, ttl=600)
+_RESPONSE_CACHE_LOCK = threading.Lock()
+# 同一個問題正在處理中時，後到的請求等待同一份結果，不重複呼叫子代理人；
+# 最多等待 S2S_INFLIGHT_TIMEOUT 秒（reply token 約 30 秒後失效），逾時則由外層回覆錯誤訊息
+_INFLIGHT: Dict[tuple, Future] = {}
+_INFLIGHT_WAIT_TIMEOUT = float(os.getenv("S2S_INFLIGHT_TIMEOUT", "25"))
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def dispatch_to_sub_agent(agent_name: str, user_id: str, message: str) -> str:
+    reply_with_status = _CACHEABLE_AGENTS.get(agent_name)
+    if reply_with_status is None:
+        return _SUB_AGENT_TOOLS[agent_name](user_id, message)
+
+    key = (agent_name, _WHITESPACE_RE.sub('', message.lower()))
+    with _RESPONSE_CACHE_LOCK:
+        reply = _RESPONSE_CACHE.get(key)
+        if reply is not None:
+            return reply
+        pending = _INFLIGHT.get(key)
+        if pending is None:
+            pending = _INFLIGHT[key] = Future()
+            is_owner = True
+        else:
+            is_owner = False
+    if not is_owner:
+        return pending.result(timeout=_INFLIGHT_WAIT_TIMEOUT)
+
+    # 不論子代理人或快取寫入是否出錯，都要移除 _INFLIGHT 並完成 Future，否則之後相同的請求會一直等待
+    reply = None
+    try:
+        reply, ok = reply_with_status(user_id, message)
+        if ok and isinstance(reply, str):
+            with _RESPONSE_CACHE_LOCK:
+                _RESPONSE_CACHE[key] = reply
+        return reply
+    except BaseException as e:
+        pending.set_exception(e)
+        raise
+    finally:
+        with _RESPONSE_CACHE_LOCK:
+            _INFLIGHT.pop(key, None)
+        if not pending.done():
+            pending.set_result(reply)
+
+def classify_intent_with_llm(message: str) -> Optional[str]:
+    """規則判斷不夠確定時，用一次 JSON 模式的 gpt-4o-mini 呼叫選出子代理人；失敗時回傳 None"""
+    if not openai_client:
+        return None
+    try:
+        response = openai_client.chat.completions.create(
+            model="gpt-4o-mini",
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": ROUTER_SYSTEM_PROMPT},
+                {"role": "user", "content": message}
+            ],
+            temperature=0,
+            max_tokens=20
+        )
+        agent_name = json.loads(response.choices[0].message.content).get("agent")
+    except Exception as e:
+        logger.warning("LLM 意圖分類失敗: %s", e)
+        return None
+    return agent_name if agent_name in _SUB_AGENT_TOOLS else None
+
 def process_with_main_agent(user_id: str, message: str, reply_token: str):
     try:
-        agent = create_main_agent()
-        prompt = f"""
-{MAIN_AGENT_SYSTEM_PROMPT}
+        intent = analyze_user_intent(message)
+        if not intent['is_shopping_related']:
+            send_line_reply(reply_token, NON_SHOPPING_REPLY)
+            return
+        primary = intent['primary_intent']
+        if primary['score'] >= _DIRECT_DISPATCH_MIN_SCORE:
+            send_line_reply(reply_token, dispatch_to_sub_agent(primary['agent'], user_id, message))
+            return
 
-現在需要處理以下用戶訊息：
-- 用戶ID: {user_id}
-- 訊息內容: {message}
-- 回覆令牌: {reply_token}
+        agent_name = classify_intent_with_llm(message)
+        if agent_name:
+            send_line_reply(reply_token, dispatch_to_sub_agent(agent_name, user_id, message))
+            return
 
-執行步驟：
-1. 使用 analyze_user_intent 分析用戶意圖
-2. 若 is_shopping_related 為 False，使用 send_line_reply 回覆拒答文案
-3. 否則依 primary_intent.agent 呼叫對應工具
-4. 用 send_line_reply 回覆用戶
-"""
-        agent.run(prompt)
+        # 分類器不可用時才退回完整的 CodeAgent 流程
+        agent = get_main_agent()
+        agent.run(f"{MAIN_AGENT_TASK_PROMPT}- 用戶ID: {user_id}\n- 訊息內容: {message}\n- 回覆令牌: {reply_token}\n")
     except Exception as e:
-        logger.error(f"主代理人處理失敗: {e}", exc_info=True)
+        logger.error("主代理人處理失敗: %s", e, exc_info=True)
         try:
             send_line_reply(reply_token, "❌ 系統處理過程中發生錯誤，請稍後再試")
         except Exception:
@@ -179,7 +400,7 @@ def callback():
         logging.error("Invalid signature")
         abort(400)
     except Exception as e:
-        logging.error(f"Handler error: {e}", exc_info=True)
+        logging.error("Handler error: %s", e, exc_info=True)
         abort(500)
     return "OK"
 
@@ -187,19 +408,33 @@ def callback():
 def handle_message(event):
     try:
         user_id = event.source.user_id
-        message_text = event.message.text.strip()
+        message_text = event.message.text.strip()[:MAX_MESSAGE_CHARS]
         reply_token = event.reply_token
-        process_with_main_agent(user_id, message_text, reply_token)
+        _EXECUTOR.submit(process_with_main_agent, user_id, message_text, reply_token)
     except Exception as e:
-        logger.error(f"訊息處理失敗: {e}", exc_info=True)
+        logger.error("訊息處理失敗: %s", e, exc_info=True)
 
-# ===== 可選：在 Render 啟動時開背景任務 =====
-@app.before_first_request
-def _maybe_start_background_tasks():
-    if os.getenv("ENABLE_PRICE_TRACKER_BG", "").lower() == "true":
-        try:
-            from agents.price_tracker_agent import PriceTrackerAgent
-            PriceTrackerAgent(line_bot_api).start_background_tasks()
-            logger.info("價格追蹤背景任務啟動成功")
-        except Exception as e:
-            logger.error(f"背景任務啟動失敗: {e}", exc_info=True)
+# ===== 可選：價格追蹤背景任務（同一台機器只啟動一份）=====
+BACKGROUND_LOCK_PATH = os.getenv("PRICE_TRACKER_LOCK_FILE", "/tmp/smartshopsaver-price-tracker.lock")
+_background_lock_file = None
+
+def start_background_tasks():
+    """由 gunicorn 的 post_worker_init 在每個 worker 呼叫；以檔案鎖確保只有一個 worker 真正啟動"""
+    global _background_lock_file
+    if os.getenv("ENABLE_PRICE_TRACKER_BG", "").lower() != "true" or _background_lock_file:
+        return
+    lock_file = open(BACKGROUND_LOCK_PATH, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        logger.info("價格追蹤背景任務已由其他 worker 執行")
+        return
+    try:
+        get_sub_agent('PriceTrackerAgent').start_background_tasks()
+        # 持有檔案鎖直到此 worker 結束；worker 被重啟時由新的 worker 接手
+        _background_lock_file = lock_file
+        logger.info("價格追蹤背景任務啟動成功")
+    except Exception as e:
+        lock_file.close()
+        logger.error("背景任務啟動失敗: %s", e, exc_info=True)
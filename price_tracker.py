@@ -1,28 +1,110 @@
 # complete_price_tracker_system.py - 完整優化的價格追蹤系統
 import os
+import atexit
 import json
 import re
 import requests
 import logging
+import functools
+import unicodedata
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass, asdict
 from urllib.parse import quote, urlparse, urljoin
 import threading
 import time
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from selectolax.parser import HTMLParser
 import cloudscraper
-from difflib import SequenceMatcher
-import random
+from cachetools import LRUCache, TTLCache
+from rapidfuzz import fuzz, process
+import itertools
+from operator import itemgetter
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 import sqlite3
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
+# 各比價網站的搜尋同時送出；執行緒在第一次提交時才建立，gunicorn preload 時不會跨 fork 共用
+_SEARCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PRICE_SEARCH_WORKERS", "8")),
+    thread_name_prefix="price-search"
+)
+
+# 比價網站搜尋結果（未過濾）的短期快取，熱門商品在 TTL 內不重複抓取與解析
+_LISTING_CACHE = TTLCache(maxsize=int(os.getenv("PRICE_LISTING_CACHE_SIZE", "512")),
+                          ttl=int(os.getenv("PRICE_LISTING_CACHE_TTL", "600")))
+_LISTING_CACHE_LOCK = threading.Lock()
+
+# 綜合搜尋結果（已過濾、已統計）的快取，鍵為 (標準查詢鍵, 是否允許配件, 最低相關分數)
+_QUERY_RESULT_CACHE = TTLCache(maxsize=int(os.getenv("PRICE_QUERY_CACHE_SIZE", "1024")),
+                               ttl=int(os.getenv("PRICE_QUERY_CACHE_TTL", "600")))
+_QUERY_RESULT_CACHE_LOCK = threading.Lock()
+
+# 各比價網站搜尋頁的解析設定
+_LISTING_SELECTORS = {
+    'FindPrice': {
+        'items': '.item, .product-item, [class*="item"]',
+        'name': '.name, .title, .product-name, h3, a[title]',
+        'price': '.price, .money, [class*="price"]',
+        'link': 'a[href*="http"]',
+        'limit': 30,
+        'title_fallback': True,
+        'base_url': None,
+    },
+    'BigGo': {
+        'items': '.track-click, .product, [data-track*="product"]',
+        'name': '.name, .title, h3, [class*="title"]',
+        'price': '.price, .money, [class*="price"]',
+        'link': 'a[href]',
+        'limit': 20,
+        'title_fallback': False,
+        'base_url': 'https://biggo.com.tw',
+    },
+}
+
+_NON_WORD_RE = re.compile(r'[^\w\s]')
+_PRICE_KEY = itemgetter('price')
+
+# 追蹤清單顯示用的時間與金額格式
+_TIME_FMT = '%m/%d %H:%M'
+# 金額可能是 float（資料庫讀回的價格都轉成 float），只能用千分位 ','，不能用 'd'
+_AMOUNT_FMT = ','
+
+
+_QUERY_KEY_STRIP_RE = re.compile(r'[\W_]+')
+
+
+def _canonical_query(product_name: str) -> str:
+    """查詢快取用的標準鍵：全形轉半形、小寫、去掉空白與標點，「iPhone 15」「iphone15」「ｉＰｈｏｎｅ－15」視為同一查詢"""
+    return _QUERY_KEY_STRIP_RE.sub('', unicodedata.normalize('NFKC', product_name).lower())
+
+
+@functools.lru_cache(maxsize=16384)
+def _normalize_name(name: str) -> str:
+    """商品名稱正規化：小寫、標點換成空白；配件判斷、品牌衝突與相似度共用同一份結果"""
+    return _NON_WORD_RE.sub(' ', name.lower()).strip()
+
+
+class _DigitsOnlyTable(dict):
+    """str.translate 用的對照表：保留十進位數字、刪除其他字元，查過的字元會記在表中"""
+    
+    def __missing__(self, codepoint: int):
+        char = chr(codepoint)
+        value = char if char.isdecimal() else None
+        self[codepoint] = value
+        return value
+
+
+_DIGITS_ONLY = _DigitsOnlyTable()
+
+# 每位使用者都常駐一份上下文與追蹤器，使用 __slots__ 省去每個實例的 __dict__
+@dataclass(slots=True)
 class PriceTracker:
     """價格追蹤器數據結構"""
     user_id: str
@@ -36,7 +118,7 @@ class PriceTracker:
     track_mode: str = "below_price"
     tracker_id: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class ConversationContext:
     """對話上下文"""
     user_id: str
@@ -85,60 +167,59 @@ class ProductFilterEngine:
             'macbook': ['dell', 'hp', 'asus', 'acer', 'lenovo', 'msi'],
             'viper': ['logitech', 'steelseries', 'corsair', 'roccat']
         }
-    
-    def is_accessory(self, product_name: str) -> bool:
-        """判斷是否為配件"""
-        product_lower = product_name.lower()
-        
-        # 檢查中文配件關鍵字
-        for keyword in self.accessory_keywords['zh']:
-            if keyword in product_lower:
-                return True
         
-        # 檢查英文配件關鍵字
-        for keyword in self.accessory_keywords['en']:
-            if keyword in product_lower:
-                return True
+        # 預先編譯關鍵字比對，一次掃描取代逐字 in 迴圈
+        self._accessory_re = re.compile('|'.join(
+            re.escape(k) for k in self.accessory_keywords['zh'] + self.accessory_keywords['en']
+        ))
+        self._brand_re = {
+            brand: re.compile('|'.join(re.escape(b) for b in excluded))
+            for brand, excluded in self.brand_exclusions.items()
+        }
         
-        return False
+        # 同樣的商品名稱會在多次查詢間重複出現，(正規化商品名稱, 正規化目標名稱) -> 相關性分數以 LRU 快取；
+        # 各網站的搜尋在不同執行緒同時計分，存取時需加鎖
+        self._score_cache = LRUCache(maxsize=8192)
+        self._score_cache_lock = threading.Lock()
+        # 一次搜尋中所有候選商品都對同一個目標名稱比對，目標品牌只需判斷一次
+        self._target_brand_norm = functools.lru_cache(maxsize=1024)(self._target_brand_norm)
     
-    def has_brand_conflict(self, product_name: str, target_name: str) -> bool:
-        """檢查品牌衝突"""
-        product_lower = product_name.lower()
-        target_lower = target_name.lower()
-        
-        # 找出目標商品的品牌
-        target_brand = None
+    # 以下 *_norm 方法的輸入皆為 _normalize_name 的結果。關鍵字與品牌只含文字字元，
+    # 所以在正規化字串上比對與在原字串小寫上比對結果相同
+    def _is_accessory_norm(self, product_norm: str) -> bool:
+        return self._accessory_re.search(product_norm) is not None
+    
+    def _target_brand_norm(self, target_norm: str) -> Optional[str]:
         for brand in self.brand_exclusions.keys():
-            if brand in target_lower:
-                target_brand = brand
-                break
-        
+            if brand in target_norm:
+                return brand
+        return None
+    
+    def _brand_conflict_norm(self, product_norm: str, target_norm: str) -> bool:
+        target_brand = self._target_brand_norm(target_norm)
         if not target_brand:
             return False
-        
-        # 檢查是否包含衝突品牌
-        conflicting_brands = self.brand_exclusions[target_brand]
-        for brand in conflicting_brands:
-            if brand in product_lower:
-                return True
-        
-        return False
+        return self._brand_re[target_brand].search(product_norm) is not None
     
-    def calculate_relevance_score(self, product_name: str, target_name: str) -> float:
-        """計算商品相關性分數（0-1）"""
-        product_clean = re.sub(r'[^\w\s]', ' ', product_name.lower()).strip()
-        target_clean = re.sub(r'[^\w\s]', ' ', target_name.lower()).strip()
-        
+    def is_accessory(self, product_name: str) -> bool:
+        """判斷是否為配件"""
+        return self._is_accessory_norm(_normalize_name(product_name))
+    
+    def has_brand_conflict(self, product_name: str, target_name: str) -> bool:
+        """檢查品牌衝突"""
+        return self._brand_conflict_norm(_normalize_name(product_name), _normalize_name(target_name))
+    
+    def _combine_score(self, product_norm: str, target_norm: str, ratio: float) -> float:
+        """由字串相似度（0-100）與關鍵字、配件、品牌規則組合出相關性分數"""
         # 基礎文字匹配
-        if target_clean in product_clean:
+        if target_norm in product_norm:
             base_score = 0.8
         else:
-            base_score = SequenceMatcher(None, product_clean, target_clean).ratio()
+            base_score = ratio / 100.0
         
         # 關鍵字匹配加分
-        target_words = set(target_clean.split())
-        product_words = set(product_clean.split())
+        target_words = set(target_norm.split())
+        product_words = set(product_norm.split())
         
         if target_words:
             overlap = len(target_words.intersection(product_words))
@@ -146,15 +227,42 @@ class ProductFilterEngine:
             base_score = max(base_score, keyword_score * 0.7)
         
         # 配件扣分
-        if self.is_accessory(product_name):
+        if self._is_accessory_norm(product_norm):
             base_score *= 0.3
         
         # 品牌衝突大幅扣分
-        if self.has_brand_conflict(product_name, target_name):
+        if self._brand_conflict_norm(product_norm, target_norm):
             base_score *= 0.1
         
         return base_score
     
+    def calculate_relevance_score(self, product_name: str, target_name: str) -> float:
+        """計算商品相關性分數（0-1）"""
+        return self.calculate_relevance_scores([product_name], target_name)[0]
+    
+    def calculate_relevance_scores(self, product_names: List[str], target_name: str) -> List[float]:
+        """批次計算多個商品的相關性分數；快取未命中的商品在 rapidfuzz 內一次算完字串相似度"""
+        target_norm = _normalize_name(target_name)
+        product_norms = [_normalize_name(name) for name in product_names]
+        
+        with self._score_cache_lock:
+            scores = [self._score_cache.get((norm, target_norm)) for norm in product_norms]
+        
+        misses = [i for i, score in enumerate(scores) if score is None]
+        if misses:
+            miss_norms = [product_norms[i] for i in misses]
+            ratios = [0.0] * len(miss_norms)
+            for _, ratio, index in process.extract(target_norm, miss_norms, scorer=fuzz.ratio, limit=None):
+                ratios[index] = ratio
+            
+            computed = {}
+            for i, norm, ratio in zip(misses, miss_norms, ratios):
+                scores[i] = computed[(norm, target_norm)] = self._combine_score(norm, target_norm, ratio)
+            with self._score_cache_lock:
+                self._score_cache.update(computed)
+        
+        return scores
+    
     def is_relevant_product(self, product_name: str, target_name: str, 
                            min_score: float = 0.65, allow_accessories: bool = False) -> bool:
         """判斷商品是否相關（改進版）"""
@@ -208,16 +316,66 @@ class EnhancedNaturalLanguageParser:
             'macbook': ['蘋果筆電', 'mac筆電', 'macbook pro', 'macbook air'],
             'viper': ['viper v3', 'viper v2', 'viper v3pro', 'viper v2pro']
         }
+        
+        # 每種意圖預先編譯成一個 alternation，一次掃描即可判斷是否命中任一關鍵字
+        self._intent_re = {
+            intent_type: re.compile('|'.join(re.escape(k) for k in keywords))
+            for intent_type, keywords in self.intent_patterns.items()
+        }
+        
+        # 別名依原本字典順序攤平，逐一取代的結果與巢狀迴圈相同
+        self._alias_pairs = tuple(
+            (alias, standard)
+            for standard, aliases in self.product_aliases.items()
+            for alias in aliases
+        )
+        
+        # 商品名稱清理用的 regex 預先編譯，需依序套用
+        self._cleaning_res = tuple(re.compile(p, re.IGNORECASE) for p in (
+            r'(請|幫我|給我|我要|想要|想買|想查|查詢|查看|搜尋|比價)',
+            r'(價格|多少錢|賣多少|值多少|要多少)',
+            r'(追蹤|監控|通知|提醒|關注)',
+            r'(低於|少於|小於|不超過|以下|以內)',
+            r'(的|之|、|，|。|！|？)',
+            r'([0-9,]+元?)'
+        ))
+        self._conservative_res = tuple(re.compile(p, re.IGNORECASE) for p in (
+            r'^(請|幫我|給我|我要)',
+            r'(多少錢|價格)$'
+        ))
+        
+        # 同一句話常被重複解析（意圖判斷、追蹤、查價），結果以 LRU 快取
+        self.normalize_product_name = functools.lru_cache(maxsize=4096)(self.normalize_product_name)
+        self.extract_product_name = functools.lru_cache(maxsize=4096)(self.extract_product_name)
+        
+        # 中文數字的寫法有限（三千、兩萬、五百...），轉換結果直接快取
+        self.chinese_to_number = functools.lru_cache(maxsize=1024)(self.chinese_to_number)
+        self._arabic_number_re = re.compile(r'[0-9,]+')
+        self._chinese_number_res = (
+            re.compile(r'([一二三四五六七八九十百千萬]+)'),
+            re.compile(r'(幾[千萬])'),
+            re.compile(r'([0-9]+[千萬])')
+        )
+        
+        # 模糊意圖匹配用的常見3C產品關鍵字，順序即優先順序
+        self.product_keywords = (
+            'iphone', 'ipad', 'macbook', 'airpods', 'apple',
+            'samsung', 'xiaomi', 'oppo', 'vivo', 'huawei',
+            'ps5', 'ps4', 'xbox', 'switch', 'nintendo',
+            'viper', 'razer', 'logitech', 'corsair',
+            '手機', '筆電', '電腦', '平板', '耳機', '滑鼠', '鍵盤'
+        )
+        self.fuzzy_track_words = ('便宜', '降', '低', '少', '打折')
+        self.fuzzy_price_words = ('多少', '價格', '錢')
     
     def normalize_product_name(self, text: str) -> str:
         """標準化商品名稱"""
         text = text.lower()
         
         # 處理商品別名
-        for standard, aliases in self.product_aliases.items():
-            for alias in aliases:
-                if alias in text:
-                    text = text.replace(alias, standard)
+        for alias, standard in self._alias_pairs:
+            if alias in text:
+                text = text.replace(alias, standard)
         
         return text.strip()
     
@@ -226,7 +384,7 @@ class EnhancedNaturalLanguageParser:
         numbers = []
         
         # 提取阿拉伯數字
-        arabic_numbers = re.findall(r'[0-9,]+', text)
+        arabic_numbers = self._arabic_number_re.findall(text)
         for num in arabic_numbers:
             try:
                 numbers.append(float(num.replace(',', '')))
@@ -234,14 +392,8 @@ class EnhancedNaturalLanguageParser:
                 pass
         
         # 處理中文數字表達
-        chinese_patterns = [
-            r'([一二三四五六七八九十百千萬]+)',
-            r'(幾[千萬])',
-            r'([0-9]+[千萬])'
-        ]
-        
-        for pattern in chinese_patterns:
-            matches = re.findall(pattern, text)
+        for pattern in self._chinese_number_res:
+            matches = pattern.findall(text)
             for match in matches:
                 try:
                     num = self.chinese_to_number(match)
@@ -308,10 +460,10 @@ class EnhancedNaturalLanguageParser:
         
         # 如果訊息很簡短，嘗試利用上下文
         if len(message) < 10 and context:
-            if any(word in message for word in ['這個', '它', '那個', '同樣']):
+            if any(word in message for word in ('這個', '它', '那個', '同樣')):
                 if context.last_product:
                     # "追蹤這個" -> 使用上次查詢的商品
-                    if any(word in message for word in self.intent_patterns['track_product']):
+                    if self._intent_re['track_product'].search(message):
                         return {
                             'action': 'track_product_need_price',
                             'product_name': context.last_product,
@@ -376,26 +528,15 @@ class EnhancedNaturalLanguageParser:
     
     def contains_intent(self, message: str, intent_type: str) -> bool:
         """檢查訊息是否包含特定意圖"""
-        keywords = self.intent_patterns.get(intent_type, [])
-        message_lower = message.lower()
-        
-        return any(keyword in message_lower for keyword in keywords)
+        pattern = self._intent_re.get(intent_type)
+        return pattern is not None and pattern.search(message.lower()) is not None
     
     def extract_product_name(self, message: str) -> Optional[str]:
         """智能提取商品名稱"""
         # 移除常見的查詢詞
-        cleaning_patterns = [
-            r'(請|幫我|給我|我要|想要|想買|想查|查詢|查看|搜尋|比價)',
-            r'(價格|多少錢|賣多少|值多少|要多少)',
-            r'(追蹤|監控|通知|提醒|關注)',
-            r'(低於|少於|小於|不超過|以下|以內)',
-            r'(的|之|、|，|。|！|？)',
-            r'([0-9,]+元?)'
-        ]
-        
         cleaned = message
-        for pattern in cleaning_patterns:
-            cleaned = re.sub(pattern, ' ', cleaned, flags=re.IGNORECASE)
+        for pattern in self._cleaning_res:
+            cleaned = pattern.sub(' ', cleaned)
         
         # 移除多餘空格
         cleaned = ' '.join(cleaned.split())
@@ -403,14 +544,9 @@ class EnhancedNaturalLanguageParser:
         # 如果清理後太短，嘗試更保守的清理
         if len(cleaned) < 3:
             # 只移除最明顯的查詢詞
-            conservative_patterns = [
-                r'^(請|幫我|給我|我要)',
-                r'(多少錢|價格)$'
-            ]
-            
             cleaned = message
-            for pattern in conservative_patterns:
-                cleaned = re.sub(pattern, '', cleaned, flags=re.IGNORECASE).strip()
+            for pattern in self._conservative_res:
+                cleaned = pattern.sub('', cleaned).strip()
         
         # 標準化商品名稱
         if cleaned:
@@ -422,35 +558,24 @@ class EnhancedNaturalLanguageParser:
         """模糊意圖匹配"""
         message_lower = message.lower()
         
-        # 檢查是否包含商品關鍵字但意圖不明
-        potential_products = []
-        
-        # 常見3C產品關鍵字
-        product_keywords = [
-            'iphone', 'ipad', 'macbook', 'airpods', 'apple',
-            'samsung', 'xiaomi', 'oppo', 'vivo', 'huawei',
-            'ps5', 'ps4', 'xbox', 'switch', 'nintendo',
-            'viper', 'razer', 'logitech', 'corsair',
-            '手機', '筆電', '電腦', '平板', '耳機', '滑鼠', '鍵盤'
-        ]
-        
-        for keyword in product_keywords:
-            if keyword in message_lower:
-                potential_products.append(keyword)
+        # 檢查是否包含商品關鍵字但意圖不明（依關鍵字表順序取第一個命中的）
+        potential_product = next(
+            (keyword for keyword in self.product_keywords if keyword in message_lower), None
+        )
         
-        if potential_products:
+        if potential_product:
             # 如果包含商品關鍵字，嘗試猜測意圖
-            if any(word in message_lower for word in ['便宜', '降', '低', '少', '打折']):
+            if any(word in message_lower for word in self.fuzzy_track_words):
                 return {
                     'action': 'track_product_need_price',
-                    'product_name': potential_products[0],
+                    'product_name': potential_product,
                     'confidence': 0.6,
-                    'suggestion': f"看起來您想追蹤 {potential_products[0]}，請告訴我目標價格"
+                    'suggestion': f"看起來您想追蹤 {potential_product}，請告訴我目標價格"
                 }
-            elif any(word in message_lower for word in ['多少', '價格', '錢']):
+            elif any(word in message_lower for word in self.fuzzy_price_words):
                 return {
                     'action': 'query_price',
-                    'product_name': potential_products[0],
+                    'product_name': potential_product,
                     'confidence': 0.6
                 }
         
@@ -475,23 +600,165 @@ class EnhancedNaturalLanguageParser:
         
         return "請問您想要做什麼？可以說「查價格」或「設定追蹤」"
 
+# 具名 SQL 語句：多數只差在參數佔位符（PostgreSQL 用 %s、SQLite 用 ?），upsert 語法則各自撰寫。
+# sqlite3 會以 SQL 字串快取每條連線的 prepared statement，固定字串可直接重用
+_SQL = {
+    name: {'postgresql': sql, 'sqlite': sql.replace('%s', '?')}
+    for name, sql in {
+        'select_active_trackers': """
+            SELECT * FROM price_trackers 
+            WHERE is_active = TRUE
+            ORDER BY user_id, created_at DESC
+        """,
+        'select_user_trackers': """
+            SELECT * FROM price_trackers 
+            WHERE user_id = %s AND is_active = TRUE
+            ORDER BY created_at DESC
+        """,
+        'update_price': """
+            UPDATE price_trackers 
+            SET last_price = %s, last_checked = %s
+            WHERE id = %s
+        """,
+        'update_tracker_target': """
+            UPDATE price_trackers 
+            SET target_price = %s, is_active = %s, created_at = %s
+            WHERE id = %s
+        """,
+        'select_preferences': """
+            SELECT * FROM user_preferences WHERE user_id = %s
+        """,
+        'select_active_tracker_id': """
+            SELECT id FROM price_trackers 
+            WHERE user_id = %s AND lower(product_name) = lower(%s) AND is_active
+        """,
+        # 建立唯一索引前，舊資料中重複的進行中追蹤器只保留最新一筆，其餘停用
+        'deactivate_duplicate_trackers': """
+            UPDATE price_trackers SET is_active = FALSE
+            WHERE is_active AND id NOT IN (
+                SELECT MAX(id) FROM price_trackers WHERE is_active
+                GROUP BY user_id, lower(product_name)
+            )
+        """,
+        'create_active_tracker_index': """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_active_tracker_product
+            ON price_trackers (user_id, lower(product_name)) WHERE is_active
+        """,
+    }.items()
+}
+# 同一用戶同名（不分大小寫）的進行中追蹤器只保留一筆，由 idx_active_tracker_product 保證；
+# 重複設定（例如兩個 worker 同時新增）時改為更新既有那筆
+_SQL['insert_tracker'] = {
+    'postgresql': """
+        INSERT INTO price_trackers 
+        (user_id, product_name, target_price, platforms, created_at, 
+         last_checked, last_price, is_active, track_mode)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (user_id, lower(product_name)) WHERE is_active
+        DO UPDATE SET target_price = EXCLUDED.target_price, platforms = EXCLUDED.platforms,
+                      created_at = EXCLUDED.created_at, track_mode = EXCLUDED.track_mode
+        RETURNING id
+    """,
+    'sqlite': """
+        INSERT INTO price_trackers 
+        (user_id, product_name, target_price, platforms, created_at, 
+         last_checked, last_price, is_active, track_mode)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, lower(product_name)) WHERE is_active
+        DO UPDATE SET target_price = excluded.target_price, platforms = excluded.platforms,
+                      created_at = excluded.created_at, track_mode = excluded.track_mode
+    """,
+}
+_SQL['upsert_allow_accessories'] = {
+    'postgresql': """
+        INSERT INTO user_preferences (user_id, allow_accessories)
+        VALUES (%s, %s)
+        ON CONFLICT (user_id) 
+        DO UPDATE SET allow_accessories = EXCLUDED.allow_accessories
+    """,
+    'sqlite': """
+        INSERT OR REPLACE INTO user_preferences 
+        (user_id, allow_accessories)
+        VALUES (?, ?)
+    """,
+}
+_SQL['insert_default_preferences'] = {
+    'postgresql': """
+        INSERT INTO user_preferences (user_id, allow_accessories, min_relevance_score)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (user_id) DO NOTHING
+    """,
+    'sqlite': """
+        INSERT OR IGNORE INTO user_preferences 
+        (user_id, allow_accessories, min_relevance_score)
+        VALUES (?, ?, ?)
+    """,
+}
+
 class DatabaseManager:
     """資料庫管理器 - 支援 SQLite 和 PostgreSQL"""
     
     def __init__(self, database_type: str = "sqlite"):
         self.database_type = database_type
-        self.connection = None
+        self.sqlite_path = 'price_tracker.db'
+        self._pg_pool = None
+        self._sqlite_local = threading.local()
+        # 偏好設定很少變動，短期快取省去每次搜尋的查詢；寫入時由 set_allow_accessories 清除
+        self._pref_cache = TTLCache(maxsize=10000, ttl=int(os.getenv('PREF_CACHE_TTL', '300')))
+        self._pref_cache_lock = threading.Lock()
+        # 待寫入的價格更新（tracker_id -> (最新價格, 檢查時間)），同一追蹤器只保留最後一筆
+        self._pending_price_updates: Dict[str, Tuple[float, datetime]] = {}
+        self._pending_lock = threading.Lock()
+        self.price_update_batch = int(os.getenv('PRICE_UPDATE_BATCH', '100'))
+        # 流量低時可能很久都湊不滿一批；最早一筆暫存超過 PRICE_UPDATE_MAX_AGE 秒就由計時器寫入，
+        # 縮短程序被強制結束（atexit 不會執行）時遺失的範圍，也讓其他 worker 能及早讀到新價格
+        self.price_update_max_age = float(os.getenv('PRICE_UPDATE_MAX_AGE', '30'))
+        self._flush_timer: Optional[threading.Timer] = None
+        atexit.register(self.flush_price_updates)
         
         if database_type == "postgresql":
             self.setup_postgresql()
         else:
             self.setup_sqlite()
+        self._bind_dialect()
+        self._create_active_tracker_index()
+    
+    def _bind_dialect(self):
+        """資料庫種類在初始化（含 PostgreSQL 回退 SQLite）後就固定，先選好該種類的語句與實作"""
+        self._statements = {name: variants[self.database_type] for name, variants in _SQL.items()}
+        if self.database_type == "postgresql":
+            self._inserted_id = lambda cursor, tracker: cursor.fetchone()['id']
+        else:
+            # upsert 走到更新時 lastrowid 不是該筆的 id，改為依唯一索引的欄位查回
+            self._inserted_id = self._select_active_tracker_id
+    
+    def _select_active_tracker_id(self, cursor, tracker: PriceTracker):
+        cursor.execute(self._statements['select_active_tracker_id'], (tracker.user_id, tracker.product_name))
+        return cursor.fetchone()['id']
+    
+    def _create_active_tracker_index(self):
+        """建立進行中追蹤器的唯一索引；獨立交易執行，失敗時不影響其他資料表"""
+        try:
+            with self.get_cursor() as cursor:
+                cursor.execute(self._statements['deactivate_duplicate_trackers'])
+                cursor.execute(self._statements['create_active_tracker_index'])
+        except Exception as e:
+            logger.warning(f"建立追蹤器唯一索引失敗: {e}")
+    
+    def _connect_sqlite(self) -> sqlite3.Connection:
+        """為目前執行緒建立 SQLite 連線"""
+        connection = sqlite3.connect(self.sqlite_path)
+        connection.row_factory = sqlite3.Row
+        # WAL 讓讀取不被寫入阻擋；synchronous=NORMAL 在 WAL 下仍能保證一致性
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA cache_size=-20000")
+        connection.execute("PRAGMA mmap_size=268435456")
+        return connection
     
     def setup_sqlite(self):
         """設定本地 SQLite 資料庫"""
         try:
-            self.connection = sqlite3.connect('price_tracker.db', check_same_thread=False)
-            self.connection.row_factory = sqlite3.Row
             self.create_tables_sqlite()
             logger.info("SQLite 資料庫初始化完成")
         except Exception as e:
@@ -505,185 +772,208 @@ class DatabaseManager:
             if not database_url:
                 raise ValueError("未設定 DATABASE_URL 環境變數")
             
-            self.connection = psycopg2.connect(database_url)
+            self._pg_pool = ThreadedConnectionPool(
+                1, int(os.getenv('DB_POOL_MAX', '20')), database_url,
+                cursor_factory=RealDictCursor
+            )
             self.create_tables_postgresql()
             logger.info("PostgreSQL 資料庫初始化完成")
         except Exception as e:
             logger.error(f"PostgreSQL 初始化失敗: {e}")
             logger.info("回退使用 SQLite 資料庫")
+            if self._pg_pool:
+                self._pg_pool.closeall()
+                self._pg_pool = None
             self.database_type = "sqlite"
             self.setup_sqlite()
     
+    @contextmanager
+    def _conn(self):
+        """取得連線：PostgreSQL 從連線池借出，SQLite 每個執行緒各持有一條"""
+        if self._pg_pool:
+            connection = self._pg_pool.getconn()
+            try:
+                yield connection
+            finally:
+                self._pg_pool.putconn(connection)
+        else:
+            connection = getattr(self._sqlite_local, 'connection', None)
+            if connection is None:
+                connection = self._sqlite_local.connection = self._connect_sqlite()
+            yield connection
+    
+    @contextmanager
+    def get_cursor(self):
+        """取得游標；區塊正常結束時 commit，發生例外時 rollback"""
+        with self._conn() as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+    
+    def execute(self, name: str, params: tuple = (), fetch: Optional[str] = None):
+        """執行 _SQL 中的具名語句（自動選用目前資料庫的版本）；fetch 為 'one' / 'all' 時回傳查詢結果"""
+        with self.get_cursor() as cursor:
+            cursor.execute(self._statements[name], params)
+            if fetch == 'one':
+                return cursor.fetchone()
+            if fetch == 'all':
+                return cursor.fetchall()
+            return None
+    
+    def executemany(self, name: str, seq_of_params: List[tuple]):
+        """以單一交易對多組參數執行 _SQL 中的具名語句"""
+        with self.get_cursor() as cursor:
+            cursor.executemany(self._statements[name], seq_of_params)
+    
     def create_tables_sqlite(self):
         """建立 SQLite 資料表"""
-        cursor = self.connection.cursor()
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS price_trackers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                product_name TEXT NOT NULL,
-                target_price REAL NOT NULL,
-                platforms TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_checked TIMESTAMP,
-                last_price REAL,
-                is_active BOOLEAN DEFAULT TRUE,
-                track_mode TEXT DEFAULT 'below_price'
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS price_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                tracker_id INTEGER,
-                product_name TEXT NOT NULL,
-                price REAL NOT NULL,
-                platform TEXT NOT NULL,
-                product_link TEXT,
-                recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (tracker_id) REFERENCES price_trackers (id)
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_preferences (
-                user_id TEXT PRIMARY KEY,
-                allow_accessories BOOLEAN DEFAULT FALSE,
-                min_relevance_score REAL DEFAULT 0.65,
-                preferred_platforms TEXT,
-                notification_settings TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        with self.get_cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS price_trackers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    product_name TEXT NOT NULL,
+                    target_price REAL NOT NULL,
+                    platforms TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_checked TIMESTAMP,
+                    last_price REAL,
+                    is_active BOOLEAN DEFAULT TRUE,
+                    track_mode TEXT DEFAULT 'below_price'
+                )
+            """)
+        
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS price_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    tracker_id INTEGER,
+                    product_name TEXT NOT NULL,
+                    price REAL NOT NULL,
+                    platform TEXT NOT NULL,
+                    product_link TEXT,
+                    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (tracker_id) REFERENCES price_trackers (id)
+                )
+            """)
+        
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS user_preferences (
+                    user_id TEXT PRIMARY KEY,
+                    allow_accessories BOOLEAN DEFAULT FALSE,
+                    min_relevance_score REAL DEFAULT 0.65,
+                    preferred_platforms TEXT,
+                    notification_settings TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
         
-        self.connection.commit()
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_sqlite_user_trackers ON price_trackers(user_id, is_active)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_sqlite_product_history ON price_history(product_name, recorded_at)")
     
     def create_tables_postgresql(self):
         """建立 PostgreSQL 資料表"""
-        cursor = self.connection.cursor()
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS price_trackers (
-                id SERIAL PRIMARY KEY,
-                user_id VARCHAR(100) NOT NULL,
-                product_name VARCHAR(200) NOT NULL,
-                target_price DECIMAL(10,2) NOT NULL,
-                platforms TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_checked TIMESTAMP,
-                last_price DECIMAL(10,2),
-                is_active BOOLEAN DEFAULT TRUE,
-                track_mode VARCHAR(50) DEFAULT 'below_price'
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS price_history (
-                id SERIAL PRIMARY KEY,
-                tracker_id INTEGER REFERENCES price_trackers(id),
-                product_name VARCHAR(200) NOT NULL,
-                price DECIMAL(10,2) NOT NULL,
-                platform VARCHAR(50) NOT NULL,
-                product_link TEXT,
-                recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_preferences (
-                user_id VARCHAR(100) PRIMARY KEY,
-                allow_accessories BOOLEAN DEFAULT FALSE,
-                min_relevance_score DECIMAL(3,2) DEFAULT 0.65,
-                preferred_platforms TEXT,
-                notification_settings TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_trackers ON price_trackers(user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_history ON price_history(product_name)")
+        with self.get_cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS price_trackers (
+                    id SERIAL PRIMARY KEY,
+                    user_id VARCHAR(100) NOT NULL,
+                    product_name VARCHAR(200) NOT NULL,
+                    target_price DECIMAL(10,2) NOT NULL,
+                    platforms TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_checked TIMESTAMP,
+                    last_price DECIMAL(10,2),
+                    is_active BOOLEAN DEFAULT TRUE,
+                    track_mode VARCHAR(50) DEFAULT 'below_price'
+                )
+            """)
+        
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS price_history (
+                    id SERIAL PRIMARY KEY,
+                    tracker_id INTEGER REFERENCES price_trackers(id),
+                    product_name VARCHAR(200) NOT NULL,
+                    price DECIMAL(10,2) NOT NULL,
+                    platform VARCHAR(50) NOT NULL,
+                    product_link TEXT,
+                    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+        
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS user_preferences (
+                    user_id VARCHAR(100) PRIMARY KEY,
+                    allow_accessories BOOLEAN DEFAULT FALSE,
+                    min_relevance_score DECIMAL(3,2) DEFAULT 0.65,
+                    preferred_platforms TEXT,
+                    notification_settings TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
         
-        self.connection.commit()
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_trackers ON price_trackers(user_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_history ON price_history(product_name)")
     
     def save_tracker(self, tracker: PriceTracker) -> str:
         """保存追蹤器到資料庫"""
-        cursor = self.connection.cursor()
-        
         try:
-            if self.database_type == "postgresql":
-                cursor.execute("""
-                    INSERT INTO price_trackers 
-                    (user_id, product_name, target_price, platforms, created_at, 
-                     last_checked, last_price, is_active, track_mode)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (
-                    tracker.user_id, tracker.product_name, tracker.target_price,
-                    ','.join(tracker.platforms), tracker.created_at,
-                    tracker.last_checked, tracker.last_price, 
-                    tracker.is_active, tracker.track_mode
-                ))
-                tracker_id = cursor.fetchone()[0]
-            else:
-                cursor.execute("""
-                    INSERT INTO price_trackers 
-                    (user_id, product_name, target_price, platforms, created_at, 
-                     last_checked, last_price, is_active, track_mode)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
+            with self.get_cursor() as cursor:
+                cursor.execute(self._statements['insert_tracker'], (
                     tracker.user_id, tracker.product_name, tracker.target_price,
                     ','.join(tracker.platforms), tracker.created_at,
                     tracker.last_checked, tracker.last_price, 
                     tracker.is_active, tracker.track_mode
                 ))
-                tracker_id = cursor.lastrowid
+                tracker_id = self._inserted_id(cursor, tracker)
             
-            self.connection.commit()
             return str(tracker_id)
             
         except Exception as e:
-            self.connection.rollback()
             logger.error(f"保存追蹤器失敗: {e}")
             raise
     
+    @staticmethod
+    def _row_to_tracker(row) -> PriceTracker:
+        """資料列轉為 PriceTracker（兩種資料庫的列都支援以欄位名稱取值）"""
+        return PriceTracker(
+            user_id=row['user_id'],
+            product_name=row['product_name'],
+            target_price=float(row['target_price']),
+            platforms=row['platforms'].split(',') if row['platforms'] else ['all'],
+            created_at=row['created_at'] if isinstance(row['created_at'], datetime) else datetime.fromisoformat(str(row['created_at'])),
+            last_checked=row['last_checked'] if row['last_checked'] and isinstance(row['last_checked'], datetime) else (datetime.fromisoformat(str(row['last_checked'])) if row['last_checked'] else None),
+            last_price=float(row['last_price']) if row['last_price'] else None,
+            is_active=bool(row['is_active']),
+            track_mode=row['track_mode'] or 'below_price',
+            tracker_id=str(row['id'])
+        )
+    
+    def load_all_active_trackers(self) -> Optional[Dict[str, List[PriceTracker]]]:
+        """以單一查詢載入所有用戶的啟用中追蹤器，依 user_id 分組；查詢失敗時回傳 None"""
+        self.flush_price_updates()
+        try:
+            rows = self.execute('select_active_trackers', fetch='all')
+            return {
+                user_id: [self._row_to_tracker(row) for row in user_rows]
+                for user_id, user_rows in itertools.groupby(rows, key=itemgetter('user_id'))
+            }
+            
+        except Exception as e:
+            logger.error(f"載入追蹤器失敗: {e}")
+            return None
+    
     def load_user_trackers(self, user_id: str) -> List[PriceTracker]:
         """從資料庫載入用戶的追蹤器"""
-        cursor = self.connection.cursor()
-        
+        self.flush_price_updates()
         try:
-            if self.database_type == "postgresql":
-                cursor.execute("""
-                    SELECT * FROM price_trackers 
-                    WHERE user_id = %s AND is_active = TRUE
-                    ORDER BY created_at DESC
-                """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT * FROM price_trackers 
-                    WHERE user_id = ? AND is_active = TRUE
-                    ORDER BY created_at DESC
-                """, (user_id,))
-            
-            rows = cursor.fetchall()
-            trackers = []
-            
-            for row in rows:
-                tracker = PriceTracker(
-                    user_id=row['user_id'],
-                    product_name=row['product_name'],
-                    target_price=float(row['target_price']),
-                    platforms=row['platforms'].split(',') if row['platforms'] else ['all'],
-                    created_at=row['created_at'] if isinstance(row['created_at'], datetime) else datetime.fromisoformat(str(row['created_at'])),
-                    last_checked=row['last_checked'] if row['last_checked'] and isinstance(row['last_checked'], datetime) else (datetime.fromisoformat(str(row['last_checked'])) if row['last_checked'] else None),
-                    last_price=float(row['last_price']) if row['last_price'] else None,
-                    is_active=bool(row['is_active']),
-                    track_mode=row['track_mode'] or 'below_price',
-                    tracker_id=str(row['id'])
-                )
-                trackers.append(tracker)
-            
-            return trackers
+            rows = self.execute('select_user_trackers', (user_id,), fetch='all')
+            return [self._row_to_tracker(row) for row in rows]
             
         except Exception as e:
             logger.error(f"載入追蹤器失敗: {e}")
@@ -691,46 +981,78 @@ class DatabaseManager:
     
     def update_tracker_price(self, tracker_id: str, current_price: float):
         """更新追蹤器的當前價格"""
-        cursor = self.connection.cursor()
-        
         try:
-            if self.database_type == "postgresql":
-                cursor.execute("""
-                    UPDATE price_trackers 
-                    SET last_price = ?, last_checked = ?
-                    WHERE id = ?
-                """, (current_price, datetime.now(), tracker_id))
-            
-            self.connection.commit()
-            
+            self.execute('update_price', (current_price, datetime.now(), tracker_id))
         except Exception as e:
             logger.error(f"更新追蹤器失敗: {e}")
     
+    def queue_price_update(self, tracker_id: str, current_price: float):
+        """暫存價格更新，累積到 PRICE_UPDATE_BATCH 筆或最早一筆超過 PRICE_UPDATE_MAX_AGE 秒時以單一交易寫入"""
+        with self._pending_lock:
+            self._pending_price_updates[tracker_id] = (current_price, datetime.now())
+            should_flush = len(self._pending_price_updates) >= self.price_update_batch
+            if not should_flush and self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.price_update_max_age, self.flush_price_updates)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        if should_flush:
+            self.flush_price_updates()
+    
+    def flush_price_updates(self):
+        """寫入所有暫存的價格更新；讀取追蹤器前、暫存逾時與程式結束時都會呼叫"""
+        with self._pending_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._pending_price_updates:
+                return
+            params = [
+                (current_price, checked_at, tracker_id)
+                for tracker_id, (current_price, checked_at) in self._pending_price_updates.items()
+            ]
+            self._pending_price_updates = {}
+        self._write_price_updates(params)
+    
+    def update_tracker_prices_bulk(self, updates: List[Tuple[str, float]]):
+        """批次更新多個追蹤器的當前價格（單一交易）"""
+        if not updates:
+            return
+        
+        checked_at = datetime.now()
+        self._write_price_updates(
+            [(current_price, checked_at, tracker_id) for tracker_id, current_price in updates]
+        )
+    
+    def _write_price_updates(self, params: List[Tuple[float, datetime, str]]):
+        """以 executemany 在單一交易內寫入 (last_price, last_checked, id)"""
+        try:
+            self.executemany('update_price', params)
+        except Exception as e:
+            logger.error(f"批次更新追蹤器失敗: {e}")
+    
     def get_user_preferences(self, user_id: str) -> Dict:
         """獲取用戶偏好設定"""
-        cursor = self.connection.cursor()
+        with self._pref_cache_lock:
+            cached = self._pref_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
         
         try:
-            if self.database_type == "postgresql":
-                cursor.execute("""
-                    SELECT * FROM user_preferences WHERE user_id = %s
-                """, (user_id,))
-            else:
-                cursor.execute("""
-                    SELECT * FROM user_preferences WHERE user_id = ?
-                """, (user_id,))
-            
-            row = cursor.fetchone()
+            row = self.execute('select_preferences', (user_id,), fetch='one')
             
             if row:
-                return {
+                prefs = {
                     'allow_accessories': bool(row['allow_accessories']),
                     'min_relevance_score': float(row['min_relevance_score']),
                     'preferred_platforms': row['preferred_platforms'],
                     'notification_settings': row['notification_settings']
                 }
             else:
-                return self.create_default_preferences(user_id)
+                prefs = self.create_default_preferences(user_id)
+            
+            with self._pref_cache_lock:
+                self._pref_cache[user_id] = prefs
+            return dict(prefs)
                 
         except Exception as e:
             logger.error(f"獲取用戶偏好失敗: {e}")
@@ -741,10 +1063,16 @@ class DatabaseManager:
                 'notification_settings': None
             }
     
+    def set_allow_accessories(self, user_id: str, allow: bool):
+        """更新用戶是否允許配件，並清除該用戶的偏好快取"""
+        try:
+            self.execute('upsert_allow_accessories', (user_id, allow))
+        finally:
+            with self._pref_cache_lock:
+                self._pref_cache.pop(user_id, None)
+    
     def create_default_preferences(self, user_id: str) -> Dict:
         """創建預設用戶偏好"""
-        cursor = self.connection.cursor()
-        
         default_prefs = {
             'allow_accessories': False,
             'min_relevance_score': 0.65,
@@ -753,20 +1081,7 @@ class DatabaseManager:
         }
         
         try:
-            if self.database_type == "postgresql":
-                cursor.execute("""
-                    INSERT INTO user_preferences (user_id, allow_accessories, min_relevance_score)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (user_id) DO NOTHING
-                """, (user_id, False, 0.65))
-            else:
-                cursor.execute("""
-                    INSERT OR IGNORE INTO user_preferences 
-                    (user_id, allow_accessories, min_relevance_score)
-                    VALUES (?, ?, ?)
-                """, (user_id, False, 0.65))
-            
-            self.connection.commit()
+            self.execute('insert_default_preferences', (user_id, False, 0.65))
             return default_prefs
             
         except Exception as e:
@@ -785,11 +1100,8 @@ class ImprovedPriceSearchAgent:
             'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:120.0) Gecko/20100101 Firefox/120.0',
         ]
-    
-    def get_headers(self):
-        """獲取隨機的請求標頭"""
-        return {
-            'User-Agent': random.choice(self.user_agents),
+        self._ua_cycle = itertools.cycle(self.user_agents)
+        self._header_base = {
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
             'Accept-Language': 'zh-TW,zh;q=0.9,en;q=0.8',
             'Accept-Encoding': 'gzip, deflate, br',
@@ -799,13 +1111,18 @@ class ImprovedPriceSearchAgent:
             'Connection': 'keep-alive'
         }
     
+    def get_headers(self):
+        """獲取請求標頭（User-Agent 輪替）"""
+        headers = self._header_base.copy()
+        headers['User-Agent'] = next(self._ua_cycle)
+        return headers
+    
     def clean_price(self, price_text: str) -> Optional[int]:
         """清理價格文字並轉換為數字"""
         if not price_text:
             return None
             
-        price_str = re.sub(r'[^\d,]', '', price_text)
-        price_str = price_str.replace(',', '')
+        price_str = price_text.translate(_DIGITS_ONLY)
         
         if not price_str:
             return None
@@ -819,27 +1136,33 @@ class ImprovedPriceSearchAgent:
         
         return None
     
+    def _get_filter_prefs(self, user_id: str = None) -> Dict:
+        """取得過濾用的用戶偏好（未設定時使用預設值）"""
+        user_prefs = {'allow_accessories': False, 'min_relevance_score': 0.65}
+        if self.db_manager and user_id:
+            user_prefs.update(self.db_manager.get_user_preferences(user_id))
+        return user_prefs
+    
     def filter_relevant_products(self, products: List[Dict], target_name: str, 
                                user_id: str = None) -> List[Dict]:
         """過濾相關商品"""
         
-        user_prefs = {'allow_accessories': False, 'min_relevance_score': 0.65}
-        if self.db_manager and user_id:
-            user_prefs.update(self.db_manager.get_user_preferences(user_id))
+        user_prefs = self._get_filter_prefs(user_id)
         
         filtered_products = []
+        engine = self.filter_engine
+        min_score = user_prefs['min_relevance_score']
+        allow_accessories = user_prefs['allow_accessories']
+        
+        # 先排除配件，其餘商品一次批次計分，判斷規則與 is_relevant_product 相同
+        candidates = [
+            product for product in products
+            if allow_accessories or not engine.is_accessory(product['name'])
+        ]
+        scores = engine.calculate_relevance_scores([p['name'] for p in candidates], target_name)
         
-        for product in products:
-            relevance_score = self.filter_engine.calculate_relevance_score(
-                product['name'], target_name
-            )
-            
-            if self.filter_engine.is_relevant_product(
-                product['name'], 
-                target_name,
-                min_score=user_prefs['min_relevance_score'],
-                allow_accessories=user_prefs['allow_accessories']
-            ):
+        for product, relevance_score in zip(candidates, scores):
+            if relevance_score >= min_score:
                 product['relevance_score'] = relevance_score
                 filtered_products.append(product)
         
@@ -851,92 +1174,116 @@ class ImprovedPriceSearchAgent:
         """搜尋 FindPrice 比價網站"""
         encoded_name = quote(product_name)
         search_url = f"https://www.findprice.com.tw/g/{encoded_name}"
-        
-        try:
-            response = self.scraper.get(search_url, headers=self.get_headers(), timeout=15)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                prices = []
-                
-                items = soup.select('.item, .product-item, [class*="item"]')
-                
-                for item in items[:30]:
-                    try:
-                        name_elem = item.select_one('.name, .title, .product-name, h3, a[title]')
-                        name = ""
-                        if name_elem:
-                            name = name_elem.get_text(strip=True) or name_elem.get('title', '')
-                        
-                        price_elem = item.select_one('.price, .money, [class*="price"]')
-                        if price_elem:
-                            price = self.clean_price(price_elem.get_text())
-                            if price and name:
-                                link_elem = item.select_one('a[href*="http"]')
-                                link = link_elem.get('href') if link_elem else search_url
-                                
-                                prices.append({
-                                    'name': name[:100],
-                                    'price': price,
-                                    'link': link,
-                                    'platform': 'FindPrice'
-                                })
-                    except Exception as e:
-                        logger.debug(f"FindPrice 項目解析錯誤: {e}")
-                        continue
-                
-                filtered_prices = self.filter_relevant_products(prices, product_name, user_id)
-                return filtered_prices, search_url
-                
-        except Exception as e:
-            logger.error(f"FindPrice 搜尋失敗: {e}")
-        
-        return [], search_url
+        return self._search_platform('FindPrice', product_name, search_url, user_id)
     
     def search_biggo(self, product_name: str, user_id: str = None) -> Tuple[List[Dict], str]:
         """搜尋 BigGo 比價網站"""
         encoded_name = quote(product_name)
         search_url = f"https://biggo.com.tw/s/{encoded_name}/"
-        
+        return self._search_platform('BigGo', product_name, search_url, user_id)
+    
+    def _search_platform(self, platform: str, product_name: str, search_url: str,
+                         user_id: str = None) -> Tuple[List[Dict], str]:
+        """抓取（或取用快取）單一平台的搜尋結果並依用戶偏好過濾"""
         try:
-            response = self.scraper.get(search_url, headers=self.get_headers(), timeout=15)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                prices = []
-                
-                items = soup.select('.track-click, .product, [data-track*="product"]')
-                
-                for item in items[:20]:
-                    try:
-                        name_elem = item.select_one('.name, .title, h3, [class*="title"]')
-                        name = name_elem.get_text(strip=True) if name_elem else ""
-                        
-                        price_elem = item.select_one('.price, .money, [class*="price"]')
-                        if price_elem:
-                            price = self.clean_price(price_elem.get_text())
-                            if price and name:
-                                link_elem = item.select_one('a[href]')
-                                link = urljoin('https://biggo.com.tw', link_elem.get('href')) if link_elem else search_url
-                                
-                                prices.append({
-                                    'name': name[:100],
-                                    'price': price,
-                                    'link': link,
-                                    'platform': 'BigGo'
-                                })
-                    except Exception as e:
-                        logger.debug(f"BigGo 項目解析錯誤: {e}")
-                        continue
-                
+            prices = self._cached_scrape(platform, product_name, search_url)
+            if prices is not None:
                 filtered_prices = self.filter_relevant_products(prices, product_name, user_id)
                 return filtered_prices, search_url
                 
         except Exception as e:
-            logger.error(f"BigGo 搜尋失敗: {e}")
+            logger.error(f"{platform} 搜尋失敗: {e}")
         
         return [], search_url
     
+    def _scrape_listing(self, platform: str, search_url: str) -> Optional[List[Dict]]:
+        """抓取並解析平台搜尋頁（未過濾），請求失敗時回傳 None"""
+        response = self.scraper.get(search_url, headers=self.get_headers(), timeout=15)
+        if response.status_code != 200:
+            return None
+        return self._parse_listing(platform, response.text, search_url)
+    
+    def _parse_listing(self, platform: str, html: str, search_url: str) -> List[Dict]:
+        """依 _LISTING_SELECTORS 的平台設定，從搜尋頁 HTML 取出商品名稱、價格與連結"""
+        selectors = _LISTING_SELECTORS[platform]
+        prices = []
+        
+        for item in HTMLParser(html).css(selectors['items'])[:selectors['limit']]:
+            try:
+                name_elem = item.css_first(selectors['name'])
+                name = ""
+                if name_elem:
+                    name = name_elem.text(strip=True)
+                    if not name and selectors['title_fallback']:
+                        name = name_elem.attributes.get('title') or ''
+                
+                price_elem = item.css_first(selectors['price'])
+                if price_elem:
+                    price = self.clean_price(price_elem.text())
+                    if price and name:
+                        link_elem = item.css_first(selectors['link'])
+                        href = link_elem.attributes.get('href') if link_elem else None
+                        if not href:
+                            link = search_url
+                        elif selectors['base_url']:
+                            link = urljoin(selectors['base_url'], href)
+                        else:
+                            link = href
+                        
+                        prices.append({
+                            'name': name[:100],
+                            'price': price,
+                            'link': link,
+                            'platform': platform
+                        })
+            except Exception as e:
+                logger.debug(f"{platform} 項目解析錯誤: {e}")
+                continue
+        
+        return prices
+    
+    def _cached_scrape(self, platform: str, product_name: str, search_url: str) -> Optional[List[Dict]]:
+        """同一平台、同一查詢在 TTL 內共用抓取結果；回傳副本，過濾時寫入的分數不會污染快取"""
+        key = (platform, ' '.join(product_name.lower().split()))
+        with _LISTING_CACHE_LOCK:
+            items = _LISTING_CACHE.get(key)
+        
+        if items is None:
+            prices = self._scrape_listing(platform, search_url)
+            if prices is None:
+                return None
+            items = tuple(prices)
+            with _LISTING_CACHE_LOCK:
+                _LISTING_CACHE[key] = items
+        else:
+            logger.info(f"{platform} 使用快取結果: {product_name}")
+        
+        return [dict(item) for item in items]
+    
     def search_comprehensive_prices(self, product_name: str, user_id: str = None) -> Dict:
         """綜合價格搜尋"""
+        # 結果只取決於商品名稱與過濾偏好，偏好相同的用戶共用同一份快取
+        user_prefs = self._get_filter_prefs(user_id)
+        cache_key = (
+            _canonical_query(product_name),
+            bool(user_prefs['allow_accessories']),
+            float(user_prefs['min_relevance_score'])
+        )
+        with _QUERY_RESULT_CACHE_LOCK:
+            cached = _QUERY_RESULT_CACHE.get(cache_key)
+        if cached is not None:
+            logger.info(f"綜合搜尋使用快取結果: {product_name}")
+            return dict(cached, product_name=product_name)
+        
+        result = self._search_comprehensive_prices(product_name, user_id)
+        
+        # 查無結果可能只是網站暫時失敗，不快取
+        if result['cheapest_item']:
+            with _QUERY_RESULT_CACHE_LOCK:
+                _QUERY_RESULT_CACHE[cache_key] = result
+        return result
+    
+    def _search_comprehensive_prices(self, product_name: str, user_id: str = None) -> Dict:
         logger.info(f"開始綜合搜尋: {product_name}")
         
         all_prices = []
@@ -947,18 +1294,25 @@ class ImprovedPriceSearchAgent:
             ('BigGo', self.search_biggo),
         ]
         
-        for source_name, search_func in search_functions:
+        # 網路等待互相重疊，總耗時約等於最慢的一個網站；先完成的先記錄，最後依原本順序合併
+        logger.info(f"同時搜尋 {', '.join(name for name, _ in search_functions)}...")
+        futures = {
+            _SEARCH_EXECUTOR.submit(search_func, product_name, user_id): source_name
+            for source_name, search_func in search_functions
+        }
+        
+        site_results = {}
+        for future in as_completed(futures):
+            source_name = futures[future]
             try:
-                logger.info(f"搜尋 {source_name}...")
-                prices, url = search_func(product_name, user_id)
+                prices, url = future.result()
                 
                 if prices:
-                    search_results[source_name] = {
+                    site_results[source_name] = {
                         'prices': prices,
                         'url': url,
                         'count': len(prices)
                     }
-                    all_prices.extend(prices)
                     logger.info(f"{source_name} 過濾後找到 {len(prices)} 個相關結果")
                 else:
                     logger.info(f"{source_name} 無相關結果")
@@ -966,18 +1320,24 @@ class ImprovedPriceSearchAgent:
             except Exception as e:
                 logger.error(f"{source_name} 搜尋失敗: {e}")
         
+        for source_name, _ in search_functions:
+            if source_name in site_results:
+                search_results[source_name] = site_results[source_name]
+                all_prices.extend(site_results[source_name]['prices'])
+        
         if not all_prices:
             return self._create_empty_result(product_name)
         
-        all_prices.sort(key=lambda x: x['price'])
+        # 排序後最低、最高價即為頭尾，不必再各掃一次
+        all_prices.sort(key=_PRICE_KEY)
         cheapest = all_prices[0]
         
         return {
             'product_name': product_name,
             'cheapest_item': cheapest,
             'min_price': cheapest['price'],
-            'max_price': max(p['price'] for p in all_prices),
-            'avg_price': sum(p['price'] for p in all_prices) / len(all_prices),
+            'max_price': all_prices[-1]['price'],
+            'avg_price': sum(map(_PRICE_KEY, all_prices)) / len(all_prices),
             'total_results': len(all_prices),
             'all_results': all_prices[:20],
             'search_results': search_results,
@@ -1007,6 +1367,9 @@ class ContextAwarePriceTracker:
         self.price_agent = ImprovedPriceSearchAgent(self.db_manager)
         self.nlp_parser = EnhancedNaturalLanguageParser()
         self.user_trackers = {}
+        # user_trackers 中已與資料庫同步過的用戶；啟動時整批載入成功後，所有用戶都以記憶體為準
+        self._loaded_users = set()
+        self._trackers_preloaded = False
         self.user_contexts = {}
         self._alert_thread = None
         self._is_running = False
@@ -1020,23 +1383,26 @@ class ContextAwarePriceTracker:
     def load_all_trackers(self):
         """從資料庫載入所有用戶的追蹤器"""
         try:
-            cursor = self.db_manager.connection.cursor()
+            trackers_by_user = self.db_manager.load_all_active_trackers()
+            if trackers_by_user is None:
+                # 整批載入失敗時不設定旗標，之後由 get_user_trackers 逐一向資料庫讀取每位用戶一次
+                return
+            self.user_trackers.update(trackers_by_user)
+            self._loaded_users.update(trackers_by_user)
+            self._trackers_preloaded = True
             
-            if self.db_manager.database_type == "postgresql":
-                cursor.execute("SELECT DISTINCT user_id FROM price_trackers WHERE is_active = TRUE")
-            else:
-                cursor.execute("SELECT DISTINCT user_id FROM price_trackers WHERE is_active = TRUE")
-            
-            user_ids = [row[0] for row in cursor.fetchall()]
-            
-            for user_id in user_ids:
-                self.user_trackers[user_id] = self.db_manager.load_user_trackers(user_id)
-            
-            logger.info(f"載入了 {len(user_ids)} 個用戶的追蹤器")
+            logger.info(f"載入了 {len(trackers_by_user)} 個用戶的追蹤器")
             
         except Exception as e:
             logger.error(f"載入追蹤器失敗: {e}")
     
+    def get_user_trackers(self, user_id: str) -> List[PriceTracker]:
+        """取得用戶的追蹤器列表，只有尚未同步過的用戶才查詢資料庫"""
+        if self.db_manager and not self._trackers_preloaded and user_id not in self._loaded_users:
+            self.user_trackers.setdefault(user_id, []).extend(self.db_manager.load_user_trackers(user_id))
+            self._loaded_users.add(user_id)
+        return self.user_trackers.setdefault(user_id, [])
+    
     def get_user_context(self, user_id: str) -> ConversationContext:
         """獲取或創建用戶上下文"""
         if user_id not in self.user_contexts:
@@ -1063,44 +1429,44 @@ class ContextAwarePriceTracker:
             result = self.price_agent.search_comprehensive_prices(product_name, user_id)
             
             if not result['cheapest_item']:
-                response = f"找不到 {product_name} 的相關主商品\n\n"
-                response += f"{result.get('filter_info', '')}\n\n"
-                response += "建議您：\n"
-                response += "• 檢查商品名稱拼寫\n"
-                response += "• 使用更通用的關鍵字\n"
-                response += "• 嘗試品牌 + 型號的組合"
+                parts = [f"找不到 {product_name} 的相關主商品\n\n"]
+                parts.append(f"{result.get('filter_info', '')}\n\n")
+                parts.append("建議您：\n")
+                parts.append("• 檢查商品名稱拼寫\n")
+                parts.append("• 使用更通用的關鍵字\n")
+                parts.append("• 嘗試品牌 + 型號的組合")
                 
-                return response
+                return "".join(parts)
             
             cheapest = result['cheapest_item']
             
-            response = f"{result['product_name']} 比價結果：\n\n"
-            response += f"最佳選擇：\n"
-            response += f"商品：{cheapest['name']}\n"
-            response += f"價格：NT${cheapest['price']:,}\n"
-            response += f"平台：{cheapest['platform']}\n"
-            response += f"購買連結：{cheapest['link']}\n\n"
+            parts = [f"{result['product_name']} 比價結果：\n\n"]
+            parts.append(f"最佳選擇：\n")
+            parts.append(f"商品：{cheapest['name']}\n")
+            parts.append(f"價格：NT${cheapest['price']:,}\n")
+            parts.append(f"平台：{cheapest['platform']}\n")
+            parts.append(f"購買連結：{cheapest['link']}\n\n")
             
             if result['total_results'] > 1:
-                response += f"價格統計（{result['total_results']} 個相關商品）：\n"
-                response += f"最低價：NT${result['min_price']:,}\n"
-                response += f"最高價：NT${result['max_price']:,}\n"
-                response += f"平均價：NT${result['avg_price']:,.0f}\n\n"
+                parts.append(f"價格統計（{result['total_results']} 個相關商品）：\n")
+                parts.append(f"最低價：NT${result['min_price']:,}\n")
+                parts.append(f"最高價：NT${result['max_price']:,}\n")
+                parts.append(f"平均價：NT${result['avg_price']:,.0f}\n\n")
             
             other_choices = result['all_results'][1:3]
             if other_choices:
-                response += f"其他優質選擇：\n"
+                parts.append(f"其他優質選擇：\n")
                 for i, item in enumerate(other_choices, 2):
-                    response += f"{i}. {item['name'][:50]}{'...' if len(item['name']) > 50 else ''}\n"
-                    response += f"   NT${item['price']:,} ({item['platform']})\n"
+                    parts.append(f"{i}. {item['name'][:50]}{'...' if len(item['name']) > 50 else ''}\n")
+                    parts.append(f"   NT${item['price']:,} ({item['platform']})\n")
                 
-                response += "\n"
+                parts.append("\n")
             
-            response += f"想追蹤此商品？輸入：\n"
-            response += f"「{product_name} 低於 {cheapest['price']} 元時通知我」\n\n"
-            response += f"{result.get('filter_info', '已自動過濾不相關商品')}"
+            parts.append(f"想追蹤此商品？輸入：\n")
+            parts.append(f"「{product_name} 低於 {cheapest['price']} 元時通知我」\n\n")
+            parts.append(f"{result.get('filter_info', '已自動過濾不相關商品')}")
             
-            return response
+            return "".join(parts)
             
         except Exception as e:
             logger.error(f"查詢價格失敗: {e}")
@@ -1121,13 +1487,8 @@ class ContextAwarePriceTracker:
             product_name = intent['product_name']
             target_price = float(intent['target_price'])
             
-            if user_id not in self.user_trackers:
-                self.user_trackers[user_id] = []
-                if self.db_manager:
-                    self.user_trackers[user_id] = self.db_manager.load_user_trackers(user_id)
-            
             existing_tracker = None
-            for tracker in self.user_trackers[user_id]:
+            for tracker in self.get_user_trackers(user_id):
                 if tracker.product_name.lower() == product_name.lower():
                     existing_tracker = tracker
                     break
@@ -1139,29 +1500,18 @@ class ContextAwarePriceTracker:
                 existing_tracker.created_at = datetime.now()
                 
                 if self.db_manager:
-                    cursor = self.db_manager.connection.cursor()
                     try:
-                        if self.db_manager.database_type == "postgresql":
-                            cursor.execute("""
-                                UPDATE price_trackers 
-                                SET target_price = %s, is_active = %s, created_at = %s
-                                WHERE id = %s
-                            """, (target_price, True, datetime.now(), existing_tracker.tracker_id))
-                        else:
-                            cursor.execute("""
-                                UPDATE price_trackers 
-                                SET target_price = ?, is_active = ?, created_at = ?
-                                WHERE id = ?
-                            """, (target_price, True, datetime.now(), existing_tracker.tracker_id))
-                        
-                        self.db_manager.connection.commit()
+                        self.db_manager.execute(
+                            'update_tracker_target',
+                            (target_price, True, datetime.now(), existing_tracker.tracker_id)
+                        )
                     except Exception as e:
                         logger.error(f"更新資料庫失敗: {e}")
                 
-                response = f"追蹤設定已更新！\n\n"
-                response += f"商品：{product_name}\n"
-                response += f"價格調整：NT${old_price:,} → NT${target_price:,}\n"
-                response += f"追蹤模式：低於目標價格時通知\n\n"
+                parts = [f"追蹤設定已更新！\n\n"]
+                parts.append(f"商品：{product_name}\n")
+                parts.append(f"價格調整：NT${old_price:,} → NT${target_price:,}\n")
+                parts.append(f"追蹤模式：低於目標價格時通知\n\n")
             else:
                 new_tracker = PriceTracker(
                     user_id=user_id,
@@ -1178,10 +1528,10 @@ class ContextAwarePriceTracker:
                 
                 self.user_trackers[user_id].append(new_tracker)
                 
-                response = f"追蹤設定成功！\n\n"
-                response += f"商品：{product_name}\n"
-                response += f"目標價格：NT${target_price:,} 以下\n"
-                response += f"通知模式：低於目標價格時立即通知\n\n"
+                parts = [f"追蹤設定成功！\n\n"]
+                parts.append(f"商品：{product_name}\n")
+                parts.append(f"目標價格：NT${target_price:,} 以下\n")
+                parts.append(f"通知模式：低於目標價格時立即通知\n\n")
             
             current_result = self.price_agent.search_comprehensive_prices(product_name, user_id)
             if current_result and current_result.get('cheapest_item'):
@@ -1192,27 +1542,27 @@ class ContextAwarePriceTracker:
                 tracker.last_checked = datetime.now()
                 
                 if self.db_manager and tracker.tracker_id:
-                    self.db_manager.update_tracker_price(tracker.tracker_id, current_price)
+                    self.db_manager.queue_price_update(tracker.tracker_id, current_price)
                 
                 if current_price <= target_price:
-                    response += f"好消息！已找到符合條件的商品：\n"
-                    response += f"當前最低價：NT${current_price:,}\n"
-                    response += f"節省金額：NT${target_price - current_price:,}\n"
-                    response += f"最佳平台：{current_result['cheapest_item']['platform']}\n"
-                    response += f"立即購買：{current_result['cheapest_item']['link']}\n\n"
-                    response += f"限時優惠，建議立即下單！"
+                    parts.append(f"好消息！已找到符合條件的商品：\n")
+                    parts.append(f"當前最低價：NT${current_price:,}\n")
+                    parts.append(f"節省金額：NT${target_price - current_price:,}\n")
+                    parts.append(f"最佳平台：{current_result['cheapest_item']['platform']}\n")
+                    parts.append(f"立即購買：{current_result['cheapest_item']['link']}\n\n")
+                    parts.append(f"限時優惠，建議立即下單！")
                 else:
-                    response += f"當前價格分析：\n"
-                    response += f"目前最低價：NT${current_price:,}\n"
-                    response += f"距離目標：NT${current_price - target_price:,}\n"
-                    response += f"需要降價：{((current_price - target_price) / current_price * 100):.1f}%\n\n"
-                    response += f"持續監控中，降價時立即通知您！"
+                    parts.append(f"當前價格分析：\n")
+                    parts.append(f"目前最低價：NT${current_price:,}\n")
+                    parts.append(f"距離目標：NT${current_price - target_price:,}\n")
+                    parts.append(f"需要降價：{((current_price - target_price) / current_price * 100):.1f}%\n\n")
+                    parts.append(f"持續監控中，降價時立即通知您！")
                 
-                response += f"\n\n{current_result.get('filter_info', '已自動過濾配件和不相關商品')}"
+                parts.append(f"\n\n{current_result.get('filter_info', '已自動過濾配件和不相關商品')}")
             else:
-                response += f"追蹤已啟動，正在收集價格資訊..."
+                parts.append(f"追蹤已啟動，正在收集價格資訊...")
             
-            return response
+            return "".join(parts)
             
         except ValueError:
             return "價格格式錯誤，請輸入有效的數字金額"
@@ -1223,76 +1573,68 @@ class ContextAwarePriceTracker:
     def handle_user_settings(self, user_id: str, message: str) -> str:
         """處理用戶設定"""
         try:
-            response = "用戶偏好設定\n\n"
+            parts = ["用戶偏好設定\n\n"]
             
             if '允許配件' in message or '包含配件' in message:
                 if self.db_manager:
-                    cursor = self.db_manager.connection.cursor()
                     try:
-                        if self.db_manager.database_type == "postgresql":
-                            cursor.execute("""
-                                INSERT INTO user_preferences (user_id, allow_accessories)
-                                VALUES (%s, %s)
-                                ON CONFLICT (user_id) 
-                                DO UPDATE SET allow_accessories = EXCLUDED.allow_accessories
-                            """, (user_id, True))
-                        else:
-                            cursor.execute("""
-                                INSERT OR REPLACE INTO user_preferences 
-                                (user_id, allow_accessories)
-                                VALUES (?, ?)
-                            """, (user_id, True))
-                        
-                        self.db_manager.connection.commit()
-                        response += "已設定為允許搜尋配件商品\n\n"
+                        self.db_manager.set_allow_accessories(user_id, True)
+                        parts.append("已設定為允許搜尋配件商品\n\n")
                     except Exception as e:
                         logger.error(f"更新偏好失敗: {e}")
-                        response += "設定更新失敗\n\n"
+                        parts.append("設定更新失敗\n\n")
             
             elif '不要配件' in message or '過濾配件' in message or '排除配件' in message:
                 if self.db_manager:
-                    cursor = self.db_manager.connection.cursor()
                     try:
-                        if self.db_manager.database_type == "postgresql":
-                            cursor.execute("""
-                                INSERT INTO user_preferences (user_id, allow_accessories)
-                                VALUES (%s, %s)
-                                ON CONFLICT (user_id) 
-                                DO UPDATE SET allow_accessories = EXCLUDED.allow_accessories
-                            """, (user_id, False))
-                        else:
-                            cursor.execute("""
-                                INSERT OR REPLACE INTO user_preferences 
-                                (user_id, allow_accessories)
-                                VALUES (?, ?)
-                            """, (user_id, False))
-                        
-                        self.db_manager.connection.commit()
-                        response += "已設定為自動過濾配件商品\n\n"
+                        self.db_manager.set_allow_accessories(user_id, False)
+                        parts.append("已設定為自動過濾配件商品\n\n")
                     except Exception as e:
                         logger.error(f"更新偏好失敗: {e}")
-                        response += "設定更新失敗\n\n"
+                        parts.append("設定更新失敗\n\n")
             
             if self.db_manager:
                 prefs = self.db_manager.get_user_preferences(user_id)
-                response += f"當前設定：\n"
-                response += f"• 配件過濾：{'關閉（允許配件）' if prefs['allow_accessories'] else '開啟（只顯示主商品）'}\n\n"
+                parts.append(f"當前設定：\n")
+                parts.append(f"• 配件過濾：{'關閉（允許配件）' if prefs['allow_accessories'] else '開啟（只顯示主商品）'}\n\n")
             
-            response += "可用設定指令：\n"
-            response += "• 「允許配件」- 搜尋結果包含配件\n"
-            response += "• 「過濾配件」- 只顯示主商品（推薦）"
+            parts.append("可用設定指令：\n")
+            parts.append("• 「允許配件」- 搜尋結果包含配件\n")
+            parts.append("• 「過濾配件」- 只顯示主商品（推薦）")
             
-            return response
+            return "".join(parts)
             
         except Exception as e:
             logger.error(f"處理設定失敗: {e}")
             return "處理設定時發生錯誤"
     
+    @staticmethod
+    def _fmt_tracker(index: int, tracker: PriceTracker) -> str:
+        """追蹤清單中單一追蹤器的顯示區塊"""
+        if tracker.last_price:
+            current = format(tracker.last_price, _AMOUNT_FMT)
+            if tracker.last_price <= tracker.target_price:
+                status = f"   當前：NT${current} (已達標！)\n"
+            else:
+                diff = format(tracker.last_price - tracker.target_price, _AMOUNT_FMT)
+                status = f"   當前：NT${current} (還需降 NT${diff})\n"
+        else:
+            status = "   狀態：等待價格檢查中...\n"
+        
+        checked = f"   更新：{tracker.last_checked.strftime(_TIME_FMT)}\n" if tracker.last_checked else ""
+        
+        return (
+            f"#{index} {tracker.product_name}\n"
+            f"   目標：NT${format(tracker.target_price, _AMOUNT_FMT)} 以下\n"
+            f"{status}{checked}\n"
+        )
+    
     def handle_list_trackers(self, user_id: str) -> str:
         """處理查看追蹤清單"""
         try:
             if self.db_manager:
                 self.user_trackers[user_id] = self.db_manager.load_user_trackers(user_id)
+                self._loaded_users.add(user_id)
             
             if user_id not in self.user_trackers or not self.user_trackers[user_id]:
                 return (
@@ -1305,40 +1647,21 @@ class ContextAwarePriceTracker:
             
             active_trackers = [t for t in self.user_trackers[user_id] if t.is_active]
             
-            response = f"您的商品追蹤清單\n"
-            response += f"更新時間：{datetime.now().strftime('%m/%d %H:%M')}\n\n"
+            now_str = datetime.now().strftime(_TIME_FMT)
+            parts = ["您的商品追蹤清單\n"]
+            parts.append(f"更新時間：{now_str}\n\n")
             
             if active_trackers:
-                response += f"進行中追蹤 ({len(active_trackers)} 項)：\n\n"
+                parts.append(f"進行中追蹤 ({len(active_trackers)} 項)：\n\n")
                 
-                for i, tracker in enumerate(active_trackers, 1):
-                    response += f"#{i} {tracker.product_name}\n"
-                    response += f"   目標：NT${tracker.target_price:,} 以下\n"
-                    
-                    if tracker.last_price:
-                        if tracker.last_price <= tracker.target_price:
-                            response += f"   當前：NT${tracker.last_price:,} (已達標！)\n"
-                        else:
-                            diff = tracker.last_price - tracker.target_price
-                            response += f"   當前：NT${tracker.last_price:,} (還需降 NT${diff:,})\n"
-                    else:
-                        response += f"   狀態：等待價格檢查中...\n"
-                    
-                    if tracker.last_checked:
-                        response += f"   更新：{tracker.last_checked.strftime('%m/%d %H:%M')}\n"
-                    
-                    response += "\n"
+                parts.extend(
+                    self._fmt_tracker(i, tracker) for i, tracker in enumerate(active_trackers, 1)
+                )
             
-            response += "想修改追蹤設定？重新輸入相同商品名稱即可更新"
+            parts.append("想修改追蹤設定？重新輸入相同商品名稱即可更新")
             
-            return response
+            return "".join(parts)
             
         except Exception as e:
             logger.error(f"查詢追蹤清單失敗: {e}")
-             price_trackers 
-                    SET last_price = %s, last_checked = %s
-                    WHERE id = %s
-                """, (current_price, datetime.now(), tracker_id))
-            else:
-                cursor.execute("""
-                    UPDATE
+            return "查詢追蹤清單時發生錯誤，請稍後再試"
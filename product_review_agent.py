@@ -1,12 +1,20 @@
 # product_review_agent.py - 商品評論子代理人（Render版本）
 import os
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass
+import functools
 import logging
+import threading
 import time
 import re
+import unicodedata
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import urllib.parse
+import httpx
+import orjson
+from cachetools import TTLCache
 from smolagents import CodeAgent, LiteLLMModel, tool
 from openai import OpenAI
 
@@ -28,8 +36,210 @@ REVIEW_SYSTEM_PROMPT = """
 - 提供實用建議
 """
 
+# 關鍵字提取用的停用詞
+_STOPWORDS = [
+    "我想", "我要", "想要", "請問", "請", "想", "在", "哪裡", 
+    "如何", "怎麼", "可以", "購買", "買", "找", "推薦", "的", 
+    "了", "嗎", "呢", "啊", "吧", "哦", "喔", "一下",
+    "評價", "評論", "好不好", "好用", "值得買", "怎麼樣"
+]
+# 多字停用詞以 regex 一次掃描移除（長詞優先，避免「值得買」只被移除「買」而留下殘字），
+# 單字停用詞之後再以 str.translate 換成空白
+_MULTI_CHAR_STOP_RE = re.compile('|'.join(
+    re.escape(w) for w in sorted((w for w in _STOPWORDS if len(w) > 1), key=len, reverse=True)
+))
+_SINGLE_CHAR_STOP_TABLE = str.maketrans({w: ' ' for w in _STOPWORDS if len(w) == 1})
+_WS_RE = re.compile(r'\s+')
+
+# 購物相關關鍵字
+_SHOPPING_KEYWORDS = [
+    "購物", "買", "商品", "產品", "價格", "優惠", "比價", "評價",
+    "蝦皮", "pchome", "momo", "樂天", "淘寶", "亞馬遜", "amazon",
+    "價錢", "多少錢", "特價", "折扣", "促銷", "好不好", "推薦",
+    "好用", "評論", "開箱", "退貨", "保固", "值得買", "便宜",
+    "記帳", "消費", "支出", "花費", "預算"
+]
+
+# 非購物相關的關鍵字（用於排除）
+_NON_SHOPPING_KEYWORDS = [
+    "天氣", "新聞", "股票", "政治", "運動", "遊戲攻略",
+    "料理", "食譜", "健康", "醫療", "教育", "學習",
+    "程式", "編程", "數學", "科學", "歷史", "地理",
+    "音樂", "電影", "書籍", "小說", "詩詞", "文學",
+    "笑話", "故事", "聊天", "你好", "謝謝", "再見"
+]
+
+# 品牌名稱
+_BRANDS = [
+    "apple", "iphone", "samsung", "sony", "nike", "adidas", 
+    "asus", "acer", "lenovo", "dell", "hp", "lg", "xiaomi",
+    "羅技", "razer", "雷蛇", "viper", "logitech", "steelseries"
+]
+
+# 排除詞與購物詞（含品牌）合成一個 regex 掃描一次：零寬 lookahead 不消耗字元，每個位置都會被檢查，
+# 購物詞不會吃掉緊接的排除詞開頭；同一位置排除詞優先
+_KEYWORD_POLARITY_RE = re.compile('(?=(?P<neg>{})|(?P<pos>{}))'.format(
+    '|'.join(map(re.escape, _NON_SHOPPING_KEYWORDS)),
+    '|'.join(map(re.escape, _SHOPPING_KEYWORDS + _BRANDS)),
+))
+_MODEL_NAME_RE = re.compile(r'[a-zA-Z]+\s*\d+|\d+\s*[a-zA-Z]+')
+
+# 評價分析的系統訊息與格式說明固定不變，商品名稱、價格與連結放在最後，
+# 讓每次請求的前綴逐字相同，可命中 OpenAI 的 prompt cache
+REVIEW_RESPONSE_SYSTEM = "你是專業的商品評論分析師，請提供客觀、實用的商品評價。"
+REVIEW_RESPONSE_PROMPT = """請為下方指定的商品生成詳細的商品評價分析，使用以下格式：
+
+【商品名稱】真實評價分析：
+⭐ 評分：[根據商品類型和品質給予1-10分評分，使用星星符號]（X/10分）
+🎁 好評率：[估計一個合理的百分比]%
+
+💰 價格區間：[原樣填入下方的價格區間]
+
+✅ 真實正面評價：
+[列出3-4點該商品的優點或正面評價]
+
+❌ 真實負面評價：
+[列出2-3點該商品的缺點或需要注意的地方]
+
+💡 購買建議：
+[給出專業的購買建議，包括適合的使用者群體和購買時機]
+
+📋 推薦購買連結：
+[原樣列出下方的推薦購買連結]
+
+商品資料：
+"""
+
+# 與購物無關的拒答文案
+NOT_SHOPPING_REPLY = "❌ 此問題與SmartShopSaver功能無關，無法回答。SmartShopSaver專注於協助您解決購物相關問題。"
+
+# 取不到價格時的價格區間文字
+PRICE_UNAVAILABLE = "無法獲取價格資訊"
+# 商品評價分析失敗時的回覆
+REVIEW_UNAVAILABLE_REPLY = "❌ 商品評價分析暫時無法使用，請稍後再試"
+
+# 推薦購買連結；備用回覆只列出前三個平台
+_URL_TEMPLATES = (
+    "• 蝦皮：https://shopee.tw/search?keyword={kw}",
+    "• PChome：https://ecshweb.pchome.com.tw/search/v3.3/?q={kw}",
+    "• MOMO：https://www.momoshop.com.tw/search/searchShop.jsp?keyword={kw}",
+    "• 樂天：https://www.rakuten.com.tw/search/{kw}/",
+    "• Yahoo奇摩：https://tw.bid.yahoo.com/search/auction/product?p={kw}",
+)
+_FALLBACK_LINK_COUNT = 3
+
+# 同一商品名稱會在取價與產生評價時各編碼一次，結果以 LRU 快取
+_quote = functools.lru_cache(maxsize=2048)(urllib.parse.quote)
+
+# PChome 查價共用同一個 Session，keep-alive 連線跨查詢重用；連線錯誤時快速重試一次
+_HTTP_SESSION = requests.Session()
+_HTTP_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10, pool_maxsize=20,
+    max_retries=Retry(total=1, backoff_factor=0.1)
+))
+
+# PChome 價格區間快取：價格不會每秒變動，短時間內的重複查詢不必再打網路
+_PRICE_CACHE = TTLCache(maxsize=int(os.getenv("REVIEW_PRICE_CACHE_SIZE", "2048")),
+                        ttl=int(os.getenv("REVIEW_PRICE_CACHE_TTL", "120")))
+_PRICE_CACHE_LOCK = threading.Lock()
+
+# LLM 評價分析快取：同一商品短時間內重複查詢時直接回傳，不再呼叫 OpenAI
+_RESPONSE_CACHE = TTLCache(maxsize=int(os.getenv("REVIEW_CACHE_SIZE", "1000")),
+                           ttl=int(os.getenv("REVIEW_CACHE_TTL", "3600")))
+_RESPONSE_CACHE_LOCK = threading.Lock()
+_CACHE_KEY_STRIP_RE = re.compile(r'[\W_]+')
+
+
+# OpenAI 客戶端在程序內共用，保留 keep-alive 連線，不必每次呼叫重新建立連線池與 TLS 交握
+_openai_client: Optional[OpenAI] = None
+_openai_client_lock = threading.Lock()
+
+
+def _get_openai_client() -> OpenAI:
+    """第一次使用時建立共用的 OpenAI 客戶端"""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                api_key = os.getenv('OPENAI_API_KEY')
+                if not api_key:
+                    raise ValueError("OPENAI_API_KEY 環境變數未設定")
+                _openai_client = OpenAI(
+                    api_key=api_key,
+                    http_client=httpx.Client(timeout=30, limits=httpx.Limits(max_keepalive_connections=20))
+                )
+    return _openai_client
+
+
+def _response_cache_key(product_name: str, price_range: str) -> tuple:
+    """評價快取鍵：商品名稱全形轉半形、小寫並去掉空白與標點，「iPhone 15」「iphone15」視為同一商品"""
+    return (_CACHE_KEY_STRIP_RE.sub('', unicodedata.normalize('NFKC', product_name).lower()), price_range)
+
+
+# 同一句查詢常在短時間內重複出現；純函數的判斷結果以 LRU 快取，@tool 包裝只負責轉交
+@functools.lru_cache(maxsize=4096)
+def _clean_keywords(text: str) -> str:
+    """移除停用詞後的商品關鍵字"""
+    if text.isascii():
+        # 停用詞都是中文，純 ASCII 查詢（如「iPhone 15 Pro」）只需整理空白
+        cleaned_text = text
+    else:
+        # 先移除多字停用詞：「購買」「請問」等詞含有單字停用詞，先換掉單字會拆散它們
+        cleaned_text = _MULTI_CHAR_STOP_RE.sub(' ', text).translate(_SINGLE_CHAR_STOP_TABLE)
+    cleaned_text = _WS_RE.sub(' ', cleaned_text).strip()
+    
+    if not cleaned_text:
+        cleaned_text = "商品"
+    
+    return cleaned_text
+
+
+@functools.lru_cache(maxsize=4096)
+def _is_shopping_query(query: str) -> bool:
+    """is_shopping_related 的判斷邏輯"""
+    # 包含任何非購物關鍵字就排除；否則有購物關鍵字或品牌名稱即視為購物相關
+    has_shopping_keyword = False
+    for match in _KEYWORD_POLARITY_RE.finditer(query.lower()):
+        if match.group('neg') is not None:
+            return False
+        has_shopping_keyword = True
+    
+    if has_shopping_keyword:
+        return True
+    
+    # 檢查是否可能是商品名稱（包含英文+數字的組合）
+    return _MODEL_NAME_RE.search(query) is not None
+
 
 # ========== 獨立工具函數（符合 smolagents 要求）==========
+def _fetch_price_range(product_name: str) -> Optional[str]:
+    """從 PChome 取得價格區間；查詢失敗或沒有結果時回傳 None"""
+    with _PRICE_CACHE_LOCK:
+        cached = _PRICE_CACHE.get(product_name)
+    if cached is not None:
+        return cached
+    
+    prices = []
+    try:
+        # PChome
+        url = f"https://ecshweb.pchome.com.tw/search/v3.3/all/results?q={_quote(product_name)}&page=1&sort=sale/dc"
+        resp = _HTTP_SESSION.get(url, timeout=5)
+        if resp.status_code == 200:
+            # orjson 直接解析原始位元組，比 resp.json() 先解碼成字串再交給標準 json 快
+            data = orjson.loads(resp.content)
+            prices = [item['price'] for item in (data.get('prods') or [])[:10] if 'price' in item]
+    except Exception as e:
+        logger.error(f"從PChome獲取價格時出錯: {str(e)}")
+    
+    if prices:
+        price_range = f"NT${min(prices):,}~NT${max(prices):,}"
+        # 查詢失敗或沒有結果時不快取，下次仍會重新查詢
+        with _PRICE_CACHE_LOCK:
+            _PRICE_CACHE[product_name] = price_range
+        return price_range
+    return None
+
+
 @tool
 def get_price_range(product_name: str) -> str:
     """
@@ -41,21 +251,7 @@ def get_price_range(product_name: str) -> str:
     Returns:
         價格區間字串
     """
-    prices = []
-    try:
-        # PChome
-        url = f"https://ecshweb.pchome.com.tw/search/v3.3/all/results?q={urllib.parse.quote(product_name)}&page=1&sort=sale/dc"
-        resp = requests.get(url, timeout=5)
-        if resp.status_code == 200:
-            data = resp.json()
-            prices = [item['price'] for item in data.get('prods', [])[:10] if 'price' in item]
-    except Exception as e:
-        logger.error(f"從PChome獲取價格時出錯: {str(e)}")
-    
-    if prices:
-        return f"NT${min(prices):,}~NT${max(prices):,}"
-    else:
-        return "無法獲取價格資訊"
+    return _fetch_price_range(product_name) or PRICE_UNAVAILABLE
 
 
 @tool
@@ -69,24 +265,8 @@ def extract_keywords(text: str) -> Dict[str, str]:
     Returns:
         包含平台和關鍵字的字典
     """
-    # 移除停用詞
-    stopwords = [
-        "我想", "我要", "想要", "請問", "請", "想", "在", "哪裡", 
-        "如何", "怎麼", "可以", "購買", "買", "找", "推薦", "的", 
-        "了", "嗎", "呢", "啊", "吧", "哦", "喔", "一下",
-        "評價", "評論", "好不好", "好用", "值得買", "怎麼樣"
-    ]
-    
-    cleaned_text = text
-    for word in stopwords:
-        cleaned_text = cleaned_text.replace(word, " ")
-    
-    cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
-    
-    if not cleaned_text:
-        cleaned_text = "商品"
-    
-    return {"platform": "all", "keywords": cleaned_text}
+    # 每次回傳新的 dict，快取內的結果不會被呼叫端修改
+    return {"platform": "all", "keywords": _clean_keywords(text)}
 
 
 @tool
@@ -100,125 +280,76 @@ def is_shopping_related(query: str) -> bool:
     Returns:
         是否與購物相關
     """
-    # 購物相關關鍵字
-    shopping_keywords = [
-        "購物", "買", "商品", "產品", "價格", "優惠", "比價", "評價",
-        "蝦皮", "pchome", "momo", "樂天", "淘寶", "亞馬遜", "amazon",
-        "價錢", "多少錢", "特價", "折扣", "促銷", "好不好", "推薦",
-        "好用", "評論", "開箱", "退貨", "保固", "值得買", "便宜",
-        "記帳", "消費", "支出", "花費", "預算"
-    ]
-    
-    # 非購物相關的關鍵字（用於排除）
-    non_shopping_keywords = [
-        "天氣", "新聞", "股票", "政治", "運動", "遊戲攻略",
-        "料理", "食譜", "健康", "醫療", "教育", "學習",
-        "程式", "編程", "數學", "科學", "歷史", "地理",
-        "音樂", "電影", "書籍", "小說", "詩詞", "文學",
-        "笑話", "故事", "聊天", "你好", "謝謝", "再見"
-    ]
-    
-    query_lower = query.lower()
-    
-    # 先檢查是否包含非購物關鍵字
-    for keyword in non_shopping_keywords:
-        if keyword in query_lower:
-            return False
-    
-    # 再檢查是否包含購物關鍵字
-    for keyword in shopping_keywords:
-        if keyword in query_lower:
-            return True
-    
-    # 檢查是否可能是商品名稱（包含英文+數字的組合）
-    if re.search(r'[a-zA-Z]+\s*\d+|\d+\s*[a-zA-Z]+', query):
-        return True
-    
-    # 檢查是否包含品牌名稱
-    brands = [
-        "apple", "iphone", "samsung", "sony", "nike", "adidas", 
-        "asus", "acer", "lenovo", "dell", "hp", "lg", "xiaomi",
-        "羅技", "razer", "雷蛇", "viper", "logitech", "steelseries"
-    ]
-    
-    for brand in brands:
-        if brand in query_lower:
-            return True
-    
-    return False
+    return _is_shopping_query(query)
 
 
-@tool
-def generate_product_response(product_name: str, price_range: str) -> str:
-    """
-    為產品生成詳細評價回應
+def _generate_review(product_name: str, price_range: str) -> Tuple[str, bool]:
+    """產生商品評價回應；第二個值表示是否為 LLM 成功產生的完整分析（備用回覆為 False）"""
+    cache_key = _response_cache_key(product_name, price_range)
+    with _RESPONSE_CACHE_LOCK:
+        cached = _RESPONSE_CACHE.get(cache_key)
+    if cached is not None:
+        logger.info(f"商品評價使用快取結果: {product_name}")
+        return cached, True
     
-    Args:
-        product_name: 商品名稱
-        price_range: 價格區間
-        
-    Returns:
-        格式化的商品評價回應
-    """
-    encoded_keyword = urllib.parse.quote(product_name)
+    encoded_keyword = _quote(product_name)
+    links = [t.format(kw=encoded_keyword) for t in _URL_TEMPLATES]
+    all_links = "\n".join(links)
     
     # 使用OpenAI生成評價分析
     try:
-        # 從環境變數獲取 API Key
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY 環境變數未設定")
+        openai_client = _get_openai_client()
         
-        # 創建OpenAI客戶端
-        openai_client = OpenAI(api_key=api_key)
-        
-        prompt = f"""請為「{product_name}」生成詳細的商品評價分析，使用以下格式：
-
-【{product_name}】真實評價分析：
-⭐ 評分：[根據商品類型和品質給予1-10分評分，使用星星符號]（X/10分）
-🎁 好評率：[估計一個合理的百分比]%
-
-💰 價格區間：{price_range}
-
-✅ 真實正面評價：
-[列出3-4點該商品的優點或正面評價]
-
-❌ 真實負面評價：
-[列出2-3點該商品的缺點或需要注意的地方]
-
-💡 購買建議：
-[給出專業的購買建議，包括適合的使用者群體和購買時機]
-
-📋 推薦購買連結：
-• 蝦皮：https://shopee.tw/search?keyword={encoded_keyword}
-• PChome：https://ecshweb.pchome.com.tw/search/v3.3/?q={encoded_keyword}
-• MOMO：https://www.momoshop.com.tw/search/searchShop.jsp?keyword={encoded_keyword}
-• 樂天：https://www.rakuten.com.tw/search/{encoded_keyword}/
-• Yahoo奇摩：https://tw.bid.yahoo.com/search/auction/product?p={encoded_keyword}"""
+        prompt = (
+            f"{REVIEW_RESPONSE_PROMPT}"
+            f"- 商品名稱：{product_name}\n"
+            f"- 價格區間：{price_range}\n"
+            f"- 推薦購買連結：\n{all_links}\n"
+        )
         
         response = openai_client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
-                {"role": "system", "content": "你是專業的商品評論分析師，請提供客觀、實用的商品評價。"},
+                {"role": "system", "content": REVIEW_RESPONSE_SYSTEM},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.7,
             max_tokens=800
         )
         
-        return response.choices[0].message.content.strip()
+        content = response.choices[0].message.content.strip()
+        # 只快取成功且有價格的分析，備用回覆與取不到價格時的分析都不寫入
+        if price_range != PRICE_UNAVAILABLE:
+            with _RESPONSE_CACHE_LOCK:
+                _RESPONSE_CACHE[cache_key] = content
+        return content, True
     except Exception as e:
         logger.error(f"生成產品回應時出錯: {str(e)}")
-        return f"""【{product_name}】商品資訊：
+        fallback_links = "\n".join(links[:_FALLBACK_LINK_COUNT])
+        fallback = f"""【{product_name}】商品資訊：
 
 💰 價格區間：{price_range}
 
 📋 推薦購買連結：
-• 蝦皮：https://shopee.tw/search?keyword={encoded_keyword}
-• PChome：https://ecshweb.pchome.com.tw/search/v3.3/?q={encoded_keyword}
-• MOMO：https://www.momoshop.com.tw/search/searchShop.jsp?keyword={encoded_keyword}
+{fallback_links}
 
 💡 詳細評價分析暫時無法提供，請直接前往購物平台查看用戶評價。"""
+        return fallback, False
+
+
+@tool
+def generate_product_response(product_name: str, price_range: str) -> str:
+    """
+    為產品生成詳細評價回應
+    
+    Args:
+        product_name: 商品名稱
+        price_range: 價格區間
+        
+    Returns:
+        格式化的商品評價回應
+    """
+    return _generate_review(product_name, price_range)[0]
 
 
 # ========== 商品評論代理人類別 ==========
@@ -231,8 +362,18 @@ class ProductReviewAgent:
         if not self.openai_api_key:
             raise ValueError("OPENAI_API_KEY 環境變數必須設定")
         
-        self.openai_client = OpenAI(api_key=self.openai_api_key)
-        self.agent = self._create_agent()
+        self.openai_client = _get_openai_client()
+        # CodeAgent 在 run() 期間會寫入自己的 memory 與步驟狀態，不能跨執行緒同時使用；
+        # 本實例由主程式跨執行緒共用，所以每個執行緒各自建立一個 CodeAgent
+        self._agent_local = threading.local()
+    
+    @property
+    def agent(self) -> CodeAgent:
+        """目前執行緒專用的 CodeAgent，第一次使用時建立"""
+        agent = getattr(self._agent_local, 'agent', None)
+        if agent is None:
+            agent = self._agent_local.agent = self._create_agent()
+        return agent
     
     def _create_agent(self) -> CodeAgent:
         """創建代理人實例"""
@@ -268,10 +409,37 @@ class ProductReviewAgent:
         Returns:
             處理結果
         """
+        return self.review(user_id, message)[0]
+    
+    def review(self, user_id: str, message: str) -> Tuple[str, bool]:
+        """
+        處理用戶訊息並回報結果是否可快取
+        
+        Args:
+            user_id: 用戶ID
+            message: 用戶訊息
+            
+        Returns:
+            (回覆內容, 是否成功)；只有取到價格且 LLM 成功產生分析、或判定與購物無關時才算成功，
+            備用回覆、代理人流程與錯誤訊息都不算
+        """
+        logger.info(f"商品評論代理人處理訊息: {message}")
+        
+        # 判斷、關鍵字與取價都是確定性的 Python 函數，直接依序呼叫，只有產生評價時才呼叫 LLM；
+        # 直接流程發生未預期錯誤時才交給代理人規劃
         try:
-            logger.info(f"商品評論代理人處理訊息: {message}")
+            if not _is_shopping_query(message):
+                return NOT_SHOPPING_REPLY, True
             
-            # 使用代理人執行邏輯
+            keywords = _clean_keywords(message)
+            price_range = _fetch_price_range(keywords)
+            reply, generated = _generate_review(keywords, price_range or PRICE_UNAVAILABLE)
+            return reply, generated and price_range is not None
+            
+        except Exception as e:
+            logger.error(f"商品評論直接處理失敗，改由代理人處理: {e}", exc_info=True)
+        
+        try:
             result = self.agent.run(f"""
 {REVIEW_SYSTEM_PROMPT}
 
@@ -279,7 +447,7 @@ class ProductReviewAgent:
 
 請執行以下步驟：
 1. 使用 is_shopping_related 檢查是否與購物相關
-2. 如果不相關，回覆："❌ 此問題與SmartShopSaver功能無關，無法回答。SmartShopSaver專注於協助您解決購物相關問題。"
+2. 如果不相關，回覆："{NOT_SHOPPING_REPLY}"
 3. 如果相關：
    - 使用 extract_keywords 提取商品關鍵字
    - 使用 get_price_range 獲取價格區間
@@ -287,14 +455,26 @@ class ProductReviewAgent:
 4. 確保回應使用繁體中文
 """)
             
-            return str(result)
+            # 代理人流程無法得知各工具是否成功，結果不視為可快取
+            return str(result), False
             
         except Exception as e:
             logger.error(f"商品評論代理人處理失敗: {e}", exc_info=True)
-            return "❌ 商品評價分析暫時無法使用，請稍後再試"
+            return REVIEW_UNAVAILABLE_REPLY, False
 
 
 # 創建代理人實例的工廠函數
-def create_product_review_agent():
-    """創建商品評論代理人實例"""
-    return ProductReviewAgent()
+# ProductReviewAgent 本身只保存 API 金鑰與共用的 OpenAI 客戶端，CodeAgent 依執行緒各自建立，
+# 所以整個程序共用一個實例即可；以鎖確保多個執行緒同時第一次呼叫時只建立一次
+_review_agent: Optional[ProductReviewAgent] = None
+_review_agent_lock = threading.Lock()
+
+
+def create_product_review_agent() -> ProductReviewAgent:
+    """取得程序內共用的商品評論代理人實例"""
+    global _review_agent
+    if _review_agent is None:
+        with _review_agent_lock:
+            if _review_agent is None:
+                _review_agent = ProductReviewAgent()
+    return _review_agent
@@ -0,0 +1,165 @@
+# tests/test_price_tracker.py - 價格追蹤代理人測試（需安裝 requirements.txt 的套件）
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+try:
+    import price_tracker
+except ImportError as e:  # 未安裝 cloudscraper、psycopg2 等相依套件時略過
+    price_tracker = None
+    _IMPORT_ERROR = e
+
+
+@unittest.skipIf(price_tracker is None, "price_tracker 相依套件未安裝")
+class HandleListTrackersTest(unittest.TestCase):
+    def setUp(self):
+        self.tracker = price_tracker.ContextAwarePriceTracker(use_database=False)
+
+    def _add(self, **kwargs):
+        fields = dict(
+            user_id='u1', product_name='iPhone 15', target_price=25000.0,
+            platforms=['all'], created_at=datetime(2024, 1, 1),
+        )
+        fields.update(kwargs)
+        tracker = price_tracker.PriceTracker(**fields)
+        self.tracker.user_trackers.setdefault('u1', []).append(tracker)
+        return tracker
+
+    def test_renders_tracker_above_target(self):
+        self._add(last_price=26500.0, last_checked=datetime(2024, 1, 2, 9, 30))
+
+        reply = self.tracker.handle_list_trackers('u1')
+
+        self.assertIn("進行中追蹤 (1 項)", reply)
+        self.assertIn("#1 iPhone 15", reply)
+        self.assertIn("目標：NT$25,000.0 以下", reply)
+        self.assertIn("當前：NT$26,500.0 (還需降 NT$1,500.0)", reply)
+        self.assertIn("更新：01/02 09:30", reply)
+
+    def test_renders_reached_and_unchecked_trackers(self):
+        self._add(last_price=24000.0)
+        self._add(product_name='PS5', target_price=12000.0)
+
+        reply = self.tracker.handle_list_trackers('u1')
+
+        self.assertIn("當前：NT$24,000.0 (已達標！)", reply)
+        self.assertIn("#2 PS5", reply)
+        self.assertIn("狀態：等待價格檢查中", reply)
+
+
+@unittest.skipIf(price_tracker is None, "price_tracker 相依套件未安裝")
+class GetUserTrackersTest(unittest.TestCase):
+    def setUp(self):
+        self.tracker = price_tracker.ContextAwarePriceTracker(use_database=False)
+        self.stored = price_tracker.PriceTracker(
+            user_id='u1', product_name='iPhone 15', target_price=25000.0,
+            platforms=['all'], created_at=datetime(2024, 1, 1), tracker_id='1',
+        )
+        self.db = mock.Mock()
+        self.db.load_user_trackers.return_value = [self.stored]
+        self.tracker.db_manager = self.db
+
+    def test_failed_preload_falls_back_to_per_user_load(self):
+        self.db.load_all_active_trackers.return_value = None
+        self.tracker.load_all_trackers()
+
+        self.assertEqual(self.tracker.get_user_trackers('u1'), [self.stored])
+        self.assertEqual(self.tracker.get_user_trackers('u1'), [self.stored])
+        self.db.load_user_trackers.assert_called_once_with('u1')
+
+    def test_preloaded_user_is_served_from_memory(self):
+        self.db.load_all_active_trackers.return_value = {'u1': [self.stored]}
+        self.tracker.load_all_trackers()
+
+        self.assertEqual(self.tracker.get_user_trackers('u1'), [self.stored])
+        self.db.load_user_trackers.assert_not_called()
+
+    def test_preloaded_cache_is_authoritative_for_users_without_trackers(self):
+        self.db.load_all_active_trackers.return_value = {'u1': [self.stored]}
+        self.tracker.load_all_trackers()
+
+        self.assertEqual(self.tracker.get_user_trackers('u2'), [])
+        self.assertEqual(self.tracker.get_user_trackers('u2'), [])
+        self.db.load_user_trackers.assert_not_called()
+
+
+@unittest.skipIf(price_tracker is None, "price_tracker 相依套件未安裝")
+class RelevanceScoreCacheTest(unittest.TestCase):
+    NAMES = ['Apple iPhone 15 128GB', 'iPhone 15 手機殼', 'Samsung Galaxy S24', 'iphone15 pro']
+
+    def test_cached_scores_match_fresh_scores(self):
+        engine = price_tracker.ProductFilterEngine()
+        first = engine.calculate_relevance_scores(self.NAMES, 'iPhone 15')
+        fresh = price_tracker.ProductFilterEngine().calculate_relevance_scores(
+            list(reversed(self.NAMES)), 'iPhone 15')
+
+        self.assertEqual(engine.calculate_relevance_scores(self.NAMES, 'iPhone 15'), first)
+        self.assertEqual(list(reversed(fresh)), first)
+        self.assertEqual(engine.calculate_relevance_score(self.NAMES[0], 'iPhone 15'), first[0])
+
+    def test_repeat_batch_skips_rapidfuzz(self):
+        engine = price_tracker.ProductFilterEngine()
+        engine.calculate_relevance_scores(self.NAMES, 'iPhone 15')
+
+        with mock.patch.object(price_tracker.process, 'extract') as extract:
+            engine.calculate_relevance_scores(self.NAMES, 'iPhone 15')
+        extract.assert_not_called()
+
+
+@unittest.skipIf(price_tracker is None, "price_tracker 相依套件未安裝")
+class PriceUpdateFlushTest(unittest.TestCase):
+    def setUp(self):
+        # DatabaseManager 把 SQLite 檔案建在目前目錄，改到暫存目錄執行
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        with mock.patch.dict(os.environ, {'PRICE_UPDATE_MAX_AGE': '0.1'}):
+            self.db = price_tracker.DatabaseManager('sqlite')
+
+    def tearDown(self):
+        self.db.flush_price_updates()
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def _stored_price(self, tracker_id):
+        with sqlite3.connect(self.db.sqlite_path) as connection:
+            row = connection.execute(
+                "SELECT last_price FROM price_trackers WHERE id = ?", (tracker_id,)
+            ).fetchone()
+        return row[0]
+
+    def test_queued_update_is_written_after_max_age(self):
+        tracker_id = self.db.save_tracker(price_tracker.PriceTracker(
+            user_id='u1', product_name='iPhone 15', target_price=25000.0,
+            platforms=['all'], created_at=datetime(2024, 1, 1),
+        ))
+
+        self.db.queue_price_update(tracker_id, 26000.0)
+
+        deadline = time.monotonic() + 2
+        while self._stored_price(tracker_id) is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self._stored_price(tracker_id), 26000.0)
+
+    def test_saving_same_product_twice_updates_existing_tracker(self):
+        first = self.db.save_tracker(price_tracker.PriceTracker(
+            user_id='u1', product_name='iPhone 15', target_price=25000.0,
+            platforms=['all'], created_at=datetime(2024, 1, 1),
+        ))
+        second = self.db.save_tracker(price_tracker.PriceTracker(
+            user_id='u1', product_name='IPHONE 15', target_price=24000.0,
+            platforms=['all'], created_at=datetime(2024, 1, 2),
+        ))
+
+        self.assertEqual(second, first)
+        trackers = self.db.load_user_trackers('u1')
+        self.assertEqual(len(trackers), 1)
+        self.assertEqual(trackers[0].target_price, 24000.0)
+
+
+if __name__ == '__main__':
+    unittest.main()